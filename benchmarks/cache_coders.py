@@ -0,0 +1,73 @@
+"""Comparing the fastapi-cache JsonCoder with OrjsonCoder on a cached product page.
+
+Usage: python -m benchmarks.cache_coders [--size 50] [--number 2000]
+"""
+import argparse
+import timeit
+from datetime import datetime
+from decimal import Decimal
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from fastapi_cache.coder import JsonCoder
+from fastapi_pagination import Page, Params
+from pydantic import TypeAdapter
+
+from src.cache import OrjsonCoder
+from src.products.schemas import ProductDiscountResponse, ProductWithDiscountResponse
+
+
+def make_page(size: int) -> Page[ProductWithDiscountResponse]:
+    category_id = uuid4()
+    items = [
+        ProductWithDiscountResponse(
+            id=uuid4(),
+            name=f"Product {number}",
+            description=f"Description of the product number {number} created at {datetime.now().isoformat()}",
+            category_id=category_id,
+            price=Decimal("1234.56") + number,
+            stock=number,
+            discounts=[ProductDiscountResponse(id=uuid4(), discount_percentage=10)] if number % 3 == 0 else [],
+        )
+        for number in range(size)
+    ]
+    return Page.create(items, total=size * 100, params=Params(page=1, size=size))
+
+
+def main(size: int, number: int) -> None:
+    page = make_page(size)
+    adapter = TypeAdapter(Page[ProductWithDiscountResponse])
+
+    json_value = JsonCoder.encode(page)
+    orjson_value = OrjsonCoder.encode(page)
+
+    def json_hit():
+        # decode, validate against the response model and render again, what every JsonCoder hit costs
+        content = adapter.validate_python(JsonCoder.decode(json_value))
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def orjson_hit():
+        # the stored body is the response body
+        return Response(orjson_value, media_type="application/json").body
+
+    rows = [
+        ("JsonCoder", len(json_value), timeit.timeit(lambda: JsonCoder.encode(page), number=number),
+         timeit.timeit(json_hit, number=number)),
+        ("OrjsonCoder", len(orjson_value), timeit.timeit(lambda: OrjsonCoder.encode(page), number=number),
+         timeit.timeit(orjson_hit, number=number)),
+    ]
+
+    print(f"page of {size} products, {number} runs")
+    print(f"{'coder':<12} {'bytes':>8} {'store, us':>10} {'hit, us':>10}")
+    for name, stored, store_time, hit_time in rows:
+        print(f"{name:<12} {stored:>8} {store_time / number * 1e6:>10.1f} {hit_time / number * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=50)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    main(args.size, args.number)
@@ -22,8 +22,8 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 from src.database import Base
 from src.auth.models import User, TokenBlacklist
-from src.products.models import Product, ProductCategory, ProductDiscount
-from src.shopping_cart.models import Cart, CartItem
+from src.products.models import Product, ProductCategory, ProductCategoryClosure, ProductDiscount
+from src.shopping_cart.models import Cart, CartItem, StockReservation
 from src.orders.models import Order, OrderItem
 target_metadata = Base.metadata
 
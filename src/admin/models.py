@@ -8,6 +8,7 @@ from src.auth.hashing import Hasher
 from src.database import async_session
 from src.exceptions import UserAlreadyExistsException
 from src.orders.models import Order
+from src.products.category_tree import category_tree_cache
 from src.products.models import Product, ProductCategory
 
 
@@ -103,6 +104,8 @@ class ProductAdmin(BaseModel, model=Product):
     column_searchable_list = [Product.name]
     form_columns = [Product.name, Product.is_active, Product.price, Product.category_id, Product.description,
                     Product.discounts]
+    column_details_exclude_list = [Product.search_vector]
+    column_export_exclude_list = [Product.search_vector]
 
 
 class ProductCategoryAdmin(BaseModel, model=ProductCategory):
@@ -114,6 +117,12 @@ class ProductCategoryAdmin(BaseModel, model=ProductCategory):
     column_searchable_list = [ProductCategory.name]
     form_columns = [ProductCategory.name, ProductCategory.description, ProductCategory.parent]
 
+    async def after_model_change(self, data, model, is_created, request):
+        await category_tree_cache.bump_version()
+
+    async def after_model_delete(self, model, request):
+        await category_tree_cache.bump_version()
+
 
 class OrdersAdmin(BaseModel, model=Order):
     name = "Orders"
@@ -16,7 +16,7 @@ from src.auth.config import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, REFRESH_TOKE
 from src.config import SECRET_KEY
 from src.database import get_db
 from fastapi.security import HTTPBasic, HTTPBasicCredentials, OAuth2PasswordBearer
-from src.exceptions import AuthFailedException
+from src.exceptions import AuthFailedException, PermissionDeniedException
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -151,4 +151,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     user = await user_dal.get_user_by_id(uuid.UUID(token_data[SUB]))
     if user is None:
         raise AuthFailedException()
-    return user
\ No newline at end of file
+    return user
+
+
+async def get_current_superuser(user: User = Depends(get_current_user)) -> User:
+    if not user.is_superuser:
+        raise PermissionDeniedException()
+    return user
@@ -0,0 +1,466 @@
+import asyncio
+import hashlib
+import inspect
+import logging
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from decimal import Decimal
+from functools import wraps
+from typing import Any, Awaitable, Callable, Iterable, Optional, Union
+
+import orjson
+from fastapi import Request, Response, status
+from fastapi_cache import Coder, FastAPICache
+from pydantic import BaseModel
+from redis.exceptions import LockError, RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import CACHE_CONTROL_MAX_AGE, CACHE_EXPIRE, CACHE_L1_MAX_BYTES, CACHE_L1_TTL
+from src.database import custom_cache_key, get_db, redis_cache_conn, redis_conn
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "fastapi-cache"
+# number of the latest invalidation, every tag remembers the number it was last invalidated under
+CACHE_VERSION_KEY = f"{CACHE_PREFIX}:version"
+CACHE_INVALIDATION_CHANNEL = f"{CACHE_PREFIX}:invalidations"
+# outlives any recompute, a generation that expired can only be older than the version a recompute started at
+CACHE_GENERATION_TTL = 60 * 60
+
+TagsBuilder = Callable[..., Union[Iterable[str], Awaitable[Iterable[str]]]]
+
+# stores the entry and indexes it under its tags, unless one of its tags was invalidated after the version the
+# entry was computed at; the tag sets are scored by the expiry of their keys, so dead keys are pruned on the way
+_store_script = redis_cache_conn.register_script("""
+local tags = tonumber(ARGV[4])
+for i = 1, tags do
+    if tonumber(redis.call('GET', KEYS[1 + tags + i]) or '0') > tonumber(ARGV[1]) then
+        return 0
+    end
+end
+local now = tonumber(redis.call('TIME')[1])
+local ttl = tonumber(ARGV[3])
+for i = 2, tags + 1 do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now)
+    redis.call('ZADD', KEYS[i], now + ttl, KEYS[1])
+    if redis.call('TTL', KEYS[i]) < ttl then
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ttl)
+return 1
+""")
+
+# deletes the keys of the tags and moves the tags to a new generation, numbered by the incremented version
+_invalidate_script = redis_cache_conn.register_script("""
+local tags = tonumber(ARGV[2])
+local version = redis.call('INCR', KEYS[1])
+local keys = {}
+for i = 2, tags + 1 do
+    for _, key in ipairs(redis.call('ZRANGE', KEYS[i], 0, -1)) do
+        table.insert(keys, key)
+    end
+end
+for i = 1, #keys, 1000 do
+    redis.call('DEL', unpack(keys, i, math.min(i + 999, #keys)))
+end
+for i = 2, tags + 1, 1000 do
+    redis.call('DEL', unpack(KEYS, i, math.min(i + 999, tags + 1)))
+end
+for i = tags + 2, 2 * tags + 1 do
+    redis.call('SET', KEYS[i], version, 'EX', ARGV[3])
+end
+table.insert(keys, 1, version)
+redis.call('PUBLISH', ARGV[1], table.concat(keys, '\n'))
+return version
+""")
+
+SINGLE_FLIGHT_WAIT = 3.0
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+SINGLE_FLIGHT_LOCK_TIMEOUT = 10
+
+_in_flight: dict[str, asyncio.Future] = {}
+_refreshing: set[str] = set()
+_pending_refreshes: set[asyncio.Task] = set()
+_pending_invalidations: set[asyncio.Task] = set()
+# invalidations scheduled while handling the current request, awaited before its response goes out
+_request_invalidations: ContextVar[Optional[set[asyncio.Task]]] = ContextVar("request_invalidations", default=None)
+
+
+class OrjsonCoder(Coder):
+    """Encoding results straight to their JSON response body, pydantic models through their own serializer."""
+
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        if isinstance(value, BaseModel):
+            return value.__pydantic_serializer__.to_json(value)
+        return orjson.dumps(value, default=_encode_default)
+
+    @classmethod
+    def decode(cls, value: bytes) -> Any:
+        return orjson.loads(value)
+
+
+def _encode_default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class LocalCache:
+    """Per worker LRU of response bodies in front of Redis, bounded by their total size.
+
+    Entries live for a few seconds at most and are dropped as soon as Redis publishes their invalidation.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = 0
+        self.size = 0
+        self._entries: OrderedDict[str, tuple[float, int, int, Any]] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[tuple[Any, int]]:
+        """The value with the cache version it was read under."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, version, value = entry
+        if expires_at <= time.monotonic():
+            self.discard([key])
+            return None
+        self._entries.move_to_end(key)
+        return value, max(version, self.version)
+
+    def set(self, key: str, value: Any, size: int, ttl: float, version: int) -> None:
+        """Keeping the entry unless it is too big or was read before the latest invalidation seen here."""
+        if not self.enabled or size > self.max_bytes or ttl <= 0 or version < self.version:
+            return
+        self.discard([key])
+        self._entries[key] = (time.monotonic() + min(ttl, self.ttl), size, version, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def discard(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def invalidate(self, version: int, keys: Iterable[str]) -> None:
+        self.version = max(self.version, version)
+        self.discard(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+local_cache = LocalCache(max_bytes=CACHE_L1_MAX_BYTES, ttl=CACHE_L1_TTL)
+cache_stats: Counter[str] = Counter()
+
+
+async def listen_invalidations() -> None:
+    """Dropping the keys purged in Redis from the local cache, all of it whenever the subscription restarts."""
+    while True:
+        try:
+            async with redis_conn.pubsub() as pubsub:
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "subscribe":
+                        local_cache.clear()
+                    elif message["type"] == "message":
+                        version, *keys = message["data"].split("\n")
+                        local_cache.invalidate(int(version), keys)
+        except RedisError:
+            logger.warning("Cache invalidation subscription lost", exc_info=True)
+        local_cache.clear()
+        await asyncio.sleep(1)
+
+
+def tag_key(tag: str) -> str:
+    return f"{CACHE_PREFIX}:tags:{tag}"
+
+
+def generation_key(tag: str) -> str:
+    return f"{CACHE_PREFIX}:generation:{tag}"
+
+
+def _tag_keys(tags: Iterable[str]) -> list[str]:
+    """Key sets of the tags followed by their generations, the layout both scripts expect."""
+    tags = sorted(set(tags))
+    return [*map(tag_key, tags), *map(generation_key, tags)]
+
+
+def cached(expire: int = CACHE_EXPIRE, tags: Optional[TagsBuilder] = None, stale_ttl: int = 0,
+           key_builder: Callable[..., str] = custom_cache_key):
+    """Caching the endpoint response in Redis and indexing its key under the tags built from the result.
+
+    The endpoint has to accept ``request: Request``, the tags builder gets the result and the endpoint kwargs.
+    For stale_ttl seconds after expire the stale response is still served while it is refreshed in the background.
+    Responses carry a hash of their body as a strong ETag, a matching If-None-Match gets a 304 without the body.
+
+    The result is encoded once by the cache coder and every hit sends the stored body as is, so the endpoint
+    has to return the exact response model, it is not validated against ``response_model`` again.
+    """
+
+    def wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            request: Request = kwargs["request"]
+            if not FastAPICache.get_enable() or request.headers.get("Cache-Control") == "no-store":
+                return await func(*args, **kwargs)
+
+            coder = FastAPICache.get_coder()
+            key = f"{CACHE_PREFIX}:{key_builder(func, *args, **kwargs)}"
+            no_cache = request.headers.get("Cache-Control") == "no-cache"
+            if_none_match = request.headers.get("If-None-Match")
+
+            if local_cache.enabled and not no_cache:
+                entry = local_cache.get(key)
+                cache_stats["l1_hits" if entry is not None else "l1_misses"] += 1
+                if entry is not None:
+                    return cached_response(entry[0], if_none_match)
+
+            try:
+                async with redis_cache_conn.pipeline(transaction=False) as pipe:
+                    # the version is read first, a local entry never outlives an invalidation it raced with
+                    version, body, ttl = await pipe.get(CACHE_VERSION_KEY).get(key).ttl(key).execute()
+            except RedisError:
+                logger.warning("Error reading cache key '%s'", key, exc_info=True)
+                return cached_response(coder.encode(await func(*args, **kwargs)), if_none_match)
+            version = int(version or 0)
+
+            async def compute(call_kwargs=kwargs) -> bytes:
+                result = await func(*args, **call_kwargs)
+                body = coder.encode(result)
+
+                result_tags = tags(result, **call_kwargs) if tags else ()
+                if inspect.isawaitable(result_tags):
+                    result_tags = await result_tags
+
+                try:
+                    await _store(key, body, result_tags, version, expire + stale_ttl)
+                except RedisError:
+                    logger.warning("Error setting cache key '%s'", key, exc_info=True)
+
+                return body
+
+            async def compute_uncached() -> bytes:
+                return coder.encode(await func(*args, **kwargs))
+
+            if body is not None and not no_cache:
+                cache_stats["redis_hits"] += 1
+                if stale_ttl and 0 <= ttl <= stale_ttl:
+                    _schedule_refresh(request, key, compute, kwargs)
+                else:
+                    local_cache.set(key, body, len(body), ttl - stale_ttl, version)
+                return cached_response(body, if_none_match)
+
+            cache_stats["redis_misses"] += 1
+            if no_cache:
+                body = await compute()
+            else:
+                body = await _single_flight(key, compute, fallback=compute_uncached)
+            # the ETag comes from the body itself, a coroutine sharing another one's result sends a matching one
+            return cached_response(body, if_none_match)
+
+        return inner
+
+    return wrapper
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def cached_response(body: bytes, if_none_match: Optional[str] = None) -> Response:
+    """The body with its ETag, or a 304 when the client already has that body."""
+    etag = _etag(body)
+    if if_none_match and etag in map(str.strip, if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_cache_headers(etag))
+    return Response(content=body, media_type="application/json", headers=_cache_headers(etag))
+
+
+def _cache_headers(etag: str) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={CACHE_CONTROL_MAX_AGE}"}
+
+
+async def _single_flight(key: str, compute: Callable[[], Awaitable], fallback: Callable[[], Awaitable]):
+    """Recomputing a missed key once: one coroutine per worker behind a future, one worker behind a Redis lock.
+
+    The others wait up to SINGLE_FLIGHT_WAIT seconds for the shared result and then run the endpoint uncached.
+    """
+    flight = _in_flight.get(key)
+    if flight is not None:
+        done, _ = await asyncio.wait({flight}, timeout=SINGLE_FLIGHT_WAIT)
+        if done and not flight.cancelled():
+            return flight.result()
+        return await fallback()
+
+    flight = _in_flight[key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await _compute_once(key, compute)
+    except BaseException:
+        # waiters see a cancelled flight and fall back instead of sharing the error
+        flight.cancel()
+        raise
+    else:
+        flight.set_result(result)
+        return result
+    finally:
+        del _in_flight[key]
+
+
+async def _compute_once(key: str, compute: Callable[[], Awaitable]):
+    lock = redis_cache_conn.lock(f"{key}:lock", timeout=SINGLE_FLIGHT_LOCK_TIMEOUT)
+    try:
+        acquired = await lock.acquire(blocking=False)
+    except RedisError:
+        return await compute()
+
+    if not acquired:
+        # another worker is recomputing the key, its result shows up in the cache
+        deadline = asyncio.get_running_loop().time() + SINGLE_FLIGHT_WAIT
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+            try:
+                async with redis_cache_conn.pipeline(transaction=False) as pipe:
+                    value, locked = await pipe.get(key).exists(lock.name).execute()
+            except RedisError:
+                break
+            if value is not None:
+                return value
+            if not locked:
+                break
+        return await compute()
+
+    try:
+        return await compute()
+    finally:
+        try:
+            await lock.release()
+        except (LockError, RedisError):
+            pass
+
+
+def _schedule_refresh(request: Request, key: str, compute: Callable[[dict], Awaitable], kwargs: dict) -> None:
+    if key in _refreshing:
+        return
+    _refreshing.add(key)
+    task = asyncio.get_running_loop().create_task(_refresh(request, key, compute, kwargs))
+    # the loop only keeps a weak reference to the task
+    _pending_refreshes.add(task)
+    task.add_done_callback(_pending_refreshes.discard)
+    task.add_done_callback(lambda _: _refreshing.discard(key))
+
+
+async def _refresh(request: Request, key: str, compute: Callable[[dict], Awaitable], kwargs: dict) -> None:
+    """Recomputing a stale key with its own database session, the request one is closed with the response."""
+    lock = redis_cache_conn.lock(f"{key}:lock", timeout=SINGLE_FLIGHT_LOCK_TIMEOUT)
+    try:
+        if not await lock.acquire(blocking=False):
+            return
+    except RedisError:
+        return
+
+    sessions = request.app.dependency_overrides.get(get_db, get_db)()
+    try:
+        db = await anext(sessions)
+        await compute({name: db if isinstance(value, AsyncSession) else value for name, value in kwargs.items()})
+    except Exception:
+        logger.warning("Error refreshing stale cache key '%s'", key, exc_info=True)
+    finally:
+        await sessions.aclose()
+        try:
+            await lock.release()
+        except (LockError, RedisError):
+            pass
+
+
+async def get_many(keys: list[str]) -> tuple[int, list[Optional[bytes]]]:
+    """Current cache version and the cached bodies of the keys, None for every miss."""
+    if not keys:
+        return 0, []
+    async with redis_cache_conn.pipeline(transaction=False) as pipe:
+        version, bodies = await pipe.get(CACHE_VERSION_KEY).mget(keys).execute()
+    cache_stats["redis_hits"] += sum(body is not None for body in bodies)
+    cache_stats["redis_misses"] += sum(body is None for body in bodies)
+    return int(version or 0), bodies
+
+
+async def _store(key: str, body: bytes, tags: Iterable[str], version: int, expire: int, client=None) -> None:
+    """Storing the entry unless one of its tags was invalidated after version, the one it was computed at."""
+    tag_keys = _tag_keys(tags)
+    await _store_script(
+        keys=[key, *tag_keys], args=[version, body, expire, len(tag_keys) // 2], client=client
+    )
+
+
+async def set_many(entries: Iterable[tuple[str, bytes, Iterable[str]]], version: int,
+                   expire: int = CACHE_EXPIRE) -> None:
+    """Storing (key, body, tags) entries in one round trip, under the same rule as cached."""
+    async with redis_cache_conn.pipeline(transaction=False) as pipe:
+        for key, body, tags in entries:
+            await _store(key, body, tags, version, expire, client=pipe)
+        await pipe.execute()
+
+
+async def invalidate_tags(*tags: str) -> None:
+    """Deleting every cached response indexed under any of the tags."""
+    if not tags:
+        return
+    try:
+        tag_keys = _tag_keys(tags)
+        await _invalidate_script(
+            keys=[CACHE_VERSION_KEY, *tag_keys],
+            args=[CACHE_INVALIDATION_CHANNEL, len(tag_keys) // 2, CACHE_GENERATION_TTL],
+        )
+    except RedisError:
+        logger.warning("Error invalidating cache tags %s", tags, exc_info=True)
+
+
+def schedule_invalidation(tags: Iterable[str]) -> None:
+    """Invalidating the tags from sync ORM hooks that run inside the event loop."""
+    tags = tuple(tags)
+    if not tags:
+        return
+    try:
+        task = asyncio.get_running_loop().create_task(invalidate_tags(*tags))
+    except RuntimeError:
+        return
+    _pending_invalidations.add(task)
+    task.add_done_callback(_pending_invalidations.discard)
+    request_invalidations = _request_invalidations.get()
+    if request_invalidations is not None:
+        request_invalidations.add(task)
+
+
+async def await_invalidations(request: Request, call_next):
+    """Middleware holding the response until the purges scheduled by the request's commits are done.
+
+    A read right after a write then never gets the body cached before it. The database session dependency is
+    torn down after the response is sent, so the wait can't live there.
+    """
+    pending: set[asyncio.Task] = set()
+    token = _request_invalidations.set(pending)
+    try:
+        response = await call_next(request)
+    finally:
+        _request_invalidations.reset(token)
+    if pending:
+        await asyncio.wait(pending)
+    return response
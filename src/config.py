@@ -12,6 +12,17 @@ SECRET_KEY: str = os.getenv("SECRET_KEY", "secret_key")
 SENTRY_URL = os.getenv("SENTRY_URL", "sentry_example_url")
 
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+CACHE_EXPIRE: int = int(os.getenv("CACHE_EXPIRE", 60 * 60 * 6))
+CACHE_STALE_TTL: int = int(os.getenv("CACHE_STALE_TTL", 60 * 10))
+CACHE_L1_MAX_BYTES: int = int(os.getenv("CACHE_L1_MAX_BYTES", 0))
+CACHE_CONTROL_MAX_AGE: int = int(os.getenv("CACHE_CONTROL_MAX_AGE", 60))
+CACHE_L1_TTL: float = float(os.getenv("CACHE_L1_TTL", 5))
+
+CART_STORE: str = os.getenv("CART_STORE", "db")
+CART_FLUSH_INTERVAL: float = float(os.getenv("CART_FLUSH_INTERVAL", 5))
+CART_VIEW_CACHE_TTL: int = int(os.getenv("CART_VIEW_CACHE_TTL", 10))
+CART_RESERVATION_TTL: int = int(os.getenv("CART_RESERVATION_TTL", 60 * 30))
+RESERVATION_SWEEP_INTERVAL: float = float(os.getenv("RESERVATION_SWEEP_INTERVAL", 30))
 
 POSTGRES_USER: str = os.getenv("POSTGRES_USER", default="postgres")
 POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", default="postgres")
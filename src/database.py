@@ -8,6 +8,7 @@ from redis.asyncio import Redis
 
 
 redis_conn = Redis(host=REDIS_HOST, port=6379, db=0, decode_responses=True)
+redis_cache_conn = Redis(host=REDIS_HOST, port=6379, db=0)
 
 async_engine = create_async_engine(DATABASE_URL, future=True, echo=True)
 async_session = sessionmaker(async_engine, expire_on_commit=False, class_=AsyncSession)
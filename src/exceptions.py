@@ -28,6 +28,14 @@ class AuthTokenExpiredException(HTTPException):
         )
 
 
+class PermissionDeniedException(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied"
+        )
+
+
 class UserAlreadyExistsException(HTTPException):
     def __init__(self) -> None:
         super().__init__(
@@ -36,6 +44,14 @@ class UserAlreadyExistsException(HTTPException):
         )
 
 
+class ProductNotFoundException(HTTPException):
+    def __init__(self) -> None:
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+
+
 class ProductAlreadyExistsException(HTTPException):
     def __init__(self) -> None:
         super().__init__(
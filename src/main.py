@@ -1,7 +1,9 @@
+import asyncio
+
 import uvicorn
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, APIRouter
+from fastapi import Depends, FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_pagination import add_pagination
 
@@ -10,16 +12,21 @@ from sqladmin import Admin
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 
+from src.cache import (CACHE_PREFIX, OrjsonCoder, await_invalidations, cache_stats, listen_invalidations,
+                       local_cache)
 from src.admin.auth import authentication_backend
 from src.admin.models import UserAdmin, ProductAdmin, ProductCategoryAdmin, OrdersAdmin
-from src.config import DEBUG, SENTRY_URL
+from src.config import CART_STORE, DEBUG, SENTRY_URL
 from src.auth.routers import auth_router
+from src.auth.services import get_current_superuser
 from src.database import async_engine
 from src.products.models import Product
 from src.products.routers import product_router
 from src.utils import create_admin_user
-from src.database import redis_conn
+from src.database import redis_cache_conn
 from src.shopping_cart.routers import cart_router
+from src.shopping_cart.reservations import sweep_reservations_forever
+from src.shopping_cart.services import flush_carts_forever
 from src.orders.routers import order_router
 
 
@@ -40,8 +47,10 @@ def create_app():
         allow_headers=["*"],
     )
 
+    fast_api_app.middleware("http")(await_invalidations)
+
     add_pagination(fast_api_app)
-    FastAPICache.init(RedisBackend(redis_conn), prefix="fastapi-cache")
+    FastAPICache.init(RedisBackend(redis_cache_conn), prefix=CACHE_PREFIX, coder=OrjsonCoder)
 
     return fast_api_app
 
@@ -71,6 +80,11 @@ if not bool(DEBUG):
 @fastapi_app.on_event("startup")
 async def startup():
     await create_admin_user()
+    if local_cache.enabled:
+        fastapi_app.state.cache_listener = asyncio.create_task(listen_invalidations())
+    fastapi_app.state.reservation_sweeper = asyncio.create_task(sweep_reservations_forever())
+    if CART_STORE == "redis":
+        fastapi_app.state.cart_flusher = asyncio.create_task(flush_carts_forever())
 
 
 admin = Admin(fastapi_app, async_engine, authentication_backend=authentication_backend)
@@ -82,6 +96,17 @@ admin.add_view(OrdersAdmin)
 
 
 main_api_router = APIRouter()
+
+
+@main_api_router.get("/cache/stats/", tags=["Cache"], dependencies=[Depends(get_current_superuser)])
+async def get_cache_stats():
+    """Hit and miss counters of this worker for the local and the Redis cache tier."""
+    return {
+        **{counter: cache_stats[counter] for counter in ("l1_hits", "l1_misses", "redis_hits", "redis_misses")},
+        "l1_entries": len(local_cache),
+        "l1_bytes": local_cache.size,
+    }
+
 fastapi_app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 fastapi_app.include_router(product_router, prefix="/products", tags=["Products"])
 fastapi_app.include_router(cart_router, prefix="/cart", tags=["Shopping Cart"])
@@ -8,7 +8,9 @@ from sqlalchemy.orm import selectinload
 
 from src.orders.models import Order, OrderStatus, OrderItem
 from src.products.models import Product
-from src.shopping_cart.models import Cart
+from src.shopping_cart.models import StockReservation
+from src.shopping_cart.reservations import lock_products, release
+from src.shopping_cart.services import get_cart_service
 
 
 class OrderService:
@@ -17,41 +19,48 @@ class OrderService:
         self.user_id = user_id
 
     async def create_order_from_cart(self) -> Order:
-        cart = await self.db.execute(
-            select(Cart)
-            .options(selectinload(Cart.items))
-            .where(Cart.user_id == self.user_id)
-        )
-        cart = cart.scalars().first()
+        cart_service = get_cart_service(self.db, self.user_id)
+        items = await cart_service.get_items()
 
-        if not cart or not cart.items:
+        if not items:
             raise ValueError("Cart is empty")
 
+        # the order, the stock, the reservations and the cart change in one transaction
         order = Order(user_id=self.user_id, status=OrderStatus.PENDING)
         self.db.add(order)
-        await self.db.commit()
-        await self.db.refresh(order)
+        await self.db.flush()
+
+        # every product of the cart and of its reservations is locked in id order, a line whose reservation expired
+        # is spent under the same lock as the reserved ones
+        reserved = await self.db.scalars(
+            select(StockReservation.product_id).where(StockReservation.user_id == self.user_id)
+        )
+        await lock_products(self.db, set(items) | set(reserved))
 
-        for item in cart.items:
+        # the cart's reservations become the order, the stock is checked against what nobody else holds
+        await release(self.db, self.user_id)
+        for product_id, quantity in items.items():
             order_item = OrderItem(
                 order_id=order.order_id,
-                product_id=item.product_id,
-                quantity=item.quantity
+                product_id=product_id,
+                quantity=quantity
             )
             self.db.add(order_item)
 
             product = await self.db.execute(
-                select(Product).where(Product.id == item.product_id)
+                select(Product).where(Product.id == product_id).execution_options(populate_existing=True)
             )
             product = product.scalars().first()
 
-            if product.stock < item.quantity:
+            if product.available_stock < quantity:
+                await self.db.rollback()
                 raise ValueError(f"Not enough stock for product {product.name}")
 
-            product.stock -= item.quantity
+            product.stock -= quantity
 
-        await self.db.delete(cart)
+        await cart_service.clear()
         await self.db.commit()
+        await cart_service.clear_committed()
 
         await self.db.refresh(order)
         return order
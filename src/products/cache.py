@@ -0,0 +1,141 @@
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.cache import CACHE_PREFIX, schedule_invalidation
+from src.products.category_tree import category_tree_cache
+from src.products.models import Product, ProductCategory, ProductDiscount
+
+
+CATALOG_TAG = "catalog"
+CATEGORIES_TAG = "categories"
+FACETS_TAG = "facets"
+PRICES_TAG = "prices"
+
+# changes of these fields keep the product on the same list pages as long as it stays in stock
+IN_PLACE_FIELDS = frozenset({"price", "stock", "reserved", "updated_at"})
+# the facet counts only see in-stock products by category and price, besides these fields
+FACET_FIELDS = frozenset({"category_id", "is_active"})
+
+
+def product_tag(product_id: UUID) -> str:
+    return f"product:{product_id}"
+
+
+def category_tag(category_id: UUID) -> str:
+    return f"category:{category_id}"
+
+
+def product_detail_key(func, *args, product_id: UUID, **kwargs) -> str:
+    """The per-product entry is keyed by the id alone, whatever the query string of the request is."""
+    return f"product:{product_id}"
+
+
+def product_detail_cache_key(product_id: UUID) -> str:
+    return f"{CACHE_PREFIX}:{product_detail_key(None, product_id=product_id)}"
+
+
+def product_detail_tags(result, product_id: UUID, **params) -> set[str]:
+    return {product_tag(product_id)}
+
+
+async def product_list_tags(result, db: AsyncSession, category_id: Optional[UUID] = None,
+                            subcategory_id: Optional[UUID] = None, min_price: Optional[Decimal] = None,
+                            max_price: Optional[Decimal] = None, sort: Optional[str] = None, **params) -> set[str]:
+    """Tags of a cached product list: the products on it, the categories and the prices it is filtered by."""
+    items = result if isinstance(result, list) else result.items
+    tags = {product_tag(item.id) for item in items}
+    if min_price is not None or max_price is not None or sort in ("price", "-price"):
+        # any price change can move products in or out of the range or around the order
+        tags.add(PRICES_TAG)
+
+    if not category_id and not subcategory_id:
+        tags.add(CATALOG_TAG)
+        return tags
+
+    tags.add(CATEGORIES_TAG)
+    if category_id:
+        tags.add(category_tag(category_id))
+    if subcategory_id:
+        category_tree = await category_tree_cache.get(db)
+        tags.update(map(category_tag, category_tree.descendants(subcategory_id)))
+    return tags
+
+
+def facets_tags(result, subcategory_id: Optional[UUID] = None, **params) -> set[str]:
+    """Facets under a subcategory count its descendants, which a category move changes."""
+    if subcategory_id:
+        return {FACETS_TAG, CATEGORIES_TAG}
+    return {FACETS_TAG}
+
+
+def product_change_tags(product: Product, updated: bool = True) -> set[str]:
+    """Tags of the cached responses a flushed product insert, update or delete makes stale."""
+    state = inspect(product)
+    tags = {product_tag(product.id)}
+    if not updated or state.attrs.price.history.has_changes():
+        tags.update({PRICES_TAG, FACETS_TAG})
+
+    if updated:
+        changed = {attr.key for attr in state.attrs if attr.history.has_changes()}
+        flipped = (_available_stock(state, previous=True) > 0) != (_available_stock(state) > 0)
+        if flipped or changed & FACET_FIELDS:
+            tags.add(FACETS_TAG)
+        if changed <= IN_PLACE_FIELDS and not flipped:
+            return tags
+
+    category_history = state.attrs.category_id.history
+    category_ids = {state.dict.get("category_id"), *category_history.deleted} - {None}
+    tags.add(CATALOG_TAG)
+    tags.update(map(category_tag, category_ids))
+    return tags
+
+
+def stock_change_tags(product_id: UUID, category_id: UUID, available_before: int, available_after: int) -> set[str]:
+    """Tags a Core stock update makes stale, the lists only change when the product runs out or is back in stock."""
+    tags = {product_tag(product_id)}
+    if (available_before > 0) != (available_after > 0):
+        tags.update({CATALOG_TAG, PRICES_TAG, FACETS_TAG, category_tag(category_id)})
+    return tags
+
+
+def add_cache_tags(db: AsyncSession, tags: set[str]) -> None:
+    """Invalidating the tags once the session commits, like the ORM changes collected on flush."""
+    db.info.setdefault("cache_tags", set()).update(tags)
+
+
+def _available_stock(state, previous: bool = False) -> int:
+    def value(key):
+        history = state.attrs[key].history
+        if previous and history.deleted:
+            return history.deleted[0]
+        current = state.dict.get(key)
+        return current if isinstance(current, int) else 0
+
+    return value("stock") - (value("reserved") or 0)
+
+
+@event.listens_for(Session, "after_flush")
+def collect_cache_tags(session, flush_context):
+    tags = session.info.setdefault("cache_tags", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Product):
+            tags.update(product_change_tags(obj, updated=obj in session.dirty))
+        elif isinstance(obj, ProductDiscount):
+            tags.update({product_tag(obj.product_id), FACETS_TAG, PRICES_TAG})
+        elif isinstance(obj, ProductCategory):
+            tags.add(CATEGORIES_TAG)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_cache_tags(session):
+    schedule_invalidation(session.info.pop("cache_tags", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_cache_tags(session):
+    session.info.pop("cache_tags", None)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from types import MappingProxyType
+from typing import Iterable, Optional
+from uuid import UUID
+
+from redis.exceptions import RedisError
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.database import redis_conn
+from src.products.models import ProductCategory, ProductCategoryClosure
+
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_TREE_VERSION_KEY = "category-tree:version"
+
+
+class CategoryTree:
+    """Immutable snapshot of the category tree with O(1) parent/children/ancestors/descendants lookups."""
+
+    __slots__ = ("version", "_parents", "_children", "_ancestors", "_descendants")
+
+    def __init__(self, version: int, paths: Iterable[tuple[UUID, UUID, int]]):
+        self.version = version
+
+        parents, children, ancestors, descendants = {}, {}, {}, {}
+        for ancestor_id, descendant_id, depth in sorted(paths, key=lambda path: path[2]):
+            children.setdefault(ancestor_id, [])
+            ancestors.setdefault(descendant_id, [])
+            descendants.setdefault(ancestor_id, set())
+            if depth == 0:
+                continue
+            if depth == 1:
+                parents[descendant_id] = ancestor_id
+                children[ancestor_id].append(descendant_id)
+            ancestors[descendant_id].append(ancestor_id)
+            descendants[ancestor_id].add(descendant_id)
+
+        self._parents = MappingProxyType(parents)
+        self._children = MappingProxyType({key: tuple(value) for key, value in children.items()})
+        self._ancestors = MappingProxyType({key: tuple(value) for key, value in ancestors.items()})
+        self._descendants = MappingProxyType({key: frozenset(value) for key, value in descendants.items()})
+
+    def __contains__(self, category_id: UUID) -> bool:
+        return category_id in self._children
+
+    def parent(self, category_id: UUID) -> Optional[UUID]:
+        return self._parents.get(category_id)
+
+    def children(self, category_id: UUID) -> tuple[UUID, ...]:
+        return self._children.get(category_id, ())
+
+    def ancestors(self, category_id: UUID) -> tuple[UUID, ...]:
+        """Ancestors ordered from the parent up to the root, handy for breadcrumbs."""
+        return self._ancestors.get(category_id, ())
+
+    def descendants(self, category_id: UUID) -> frozenset[UUID]:
+        return self._descendants.get(category_id, frozenset())
+
+
+class CategoryTreeCache:
+    """Per worker category tree, reloaded lazily once the version counter in Redis moves."""
+
+    def __init__(self):
+        self._tree: Optional[CategoryTree] = None
+        self._lock = asyncio.Lock()
+        self._pending_bumps: set[asyncio.Task] = set()
+
+    async def get(self, db: AsyncSession) -> CategoryTree:
+        try:
+            version = int(await redis_conn.get(CATEGORY_TREE_VERSION_KEY) or 0)
+        except RedisError:
+            # the snapshot can't be checked without the version, a fresh tree is read and not kept
+            logger.warning("Error reading the category tree version", exc_info=True)
+            return await self._load(db, version=-1)
+
+        if self._tree is not None and self._tree.version == version:
+            return self._tree
+
+        async with self._lock:
+            if self._tree is None or self._tree.version != version:
+                self._tree = await self._load(db, version)
+        return self._tree
+
+    @staticmethod
+    async def _load(db: AsyncSession, version: int) -> CategoryTree:
+        result = await db.execute(select(
+            ProductCategoryClosure.ancestor_id, ProductCategoryClosure.descendant_id, ProductCategoryClosure.depth
+        ))
+        return CategoryTree(version, result.all())
+
+    @staticmethod
+    async def bump_version() -> None:
+        try:
+            await redis_conn.incr(CATEGORY_TREE_VERSION_KEY)
+        except RedisError:
+            logger.warning("Error bumping the category tree version", exc_info=True)
+
+    def schedule_bump(self) -> None:
+        """Bumping the version from sync ORM hooks that run inside the event loop."""
+        try:
+            task = asyncio.get_running_loop().create_task(self.bump_version())
+        except RuntimeError:
+            return
+        self._pending_bumps.add(task)
+        task.add_done_callback(self._pending_bumps.discard)
+
+
+category_tree_cache = CategoryTreeCache()
+
+
+@event.listens_for(Session, "after_flush")
+def mark_category_tree_changed(session, flush_context):
+    if any(isinstance(obj, ProductCategory) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["category_tree_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def bump_category_tree_version(session):
+    if session.info.pop("category_tree_changed", False):
+        category_tree_cache.schedule_bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_category_tree_changes(session):
+    session.info.pop("category_tree_changed", None)
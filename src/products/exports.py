@@ -0,0 +1,82 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.products.models import Product
+from src.products.schemas import ProductExportRow
+from src.products.services import ProductDiscountService
+
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_BUFFER_SIZE = 1 << 16
+
+
+class ProductExportService:
+    """Streaming the whole catalog from a server-side cursor, memory stays constant whatever the catalog size."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def iter_products(self, updated_since: Optional[datetime] = None) -> AsyncIterator[ProductExportRow]:
+        query = select(
+            Product.id, Product.name, Product.description, Product.category_id, Product.price, Product.stock,
+            Product.available_stock.label("available_stock"), Product.is_active, Product.updated_at,
+        )
+        if updated_since:
+            query = query.where(Product.updated_at >= updated_since)
+        query = ProductDiscountService.apply_discount(query.order_by(Product.updated_at, Product.id))
+
+        result = await self.db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for row in result:
+            yield ProductExportRow(
+                id=row.id,
+                name=row.name,
+                description=row.description,
+                category_id=row.category_id,
+                price=row.final_price,
+                base_price=row.price,
+                discount_percentage=row.discount_percentage,
+                stock=row.stock,
+                available_stock=row.available_stock,
+                is_active=row.is_active,
+                updated_at=row.updated_at,
+            )
+
+    async def export(self, format: str = "ndjson", compress: bool = False,
+                     updated_since: Optional[datetime] = None) -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        if format == "csv":
+            writer.writerow(ProductExportRow.model_fields)
+
+        async for product in self.iter_products(updated_since):
+            if format == "csv":
+                writer.writerow(product.model_dump(mode="json").values())
+            else:
+                buffer.write(product.model_dump_json())
+                buffer.write("\n")
+
+            if buffer.tell() >= EXPORT_BUFFER_SIZE:
+                chunk = self._encode(buffer, compressor)
+                if chunk:
+                    yield chunk
+
+        chunk = self._encode(buffer, compressor)
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _encode(buffer: io.StringIO, compressor) -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
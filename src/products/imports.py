@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import uuid
+from typing import AsyncIterator, Optional
+
+from asyncpg import PostgresError
+from pydantic import ValidationError
+from sqlalchemy import Integer, Numeric, String, column, func, literal_column, select, table, text
+from sqlalchemy.dialects.postgresql import UUID, insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.cache import invalidate_tags
+from src.database import async_session
+from src.products.cache import CATALOG_TAG, CATEGORIES_TAG, FACETS_TAG, PRICES_TAG, product_tag
+from src.products.models import Product, ProductCategory
+from src.products.schemas import ProductCreate, ProductImportError, ProductImportResult
+
+
+IMPORT_CHUNK_SIZE = 5000
+MAX_PRICE = 10 ** 8
+MAX_STOCK = 2 ** 31 - 1
+
+staging = table(
+    "product_import_staging",
+    column("line", Integer),
+    column("id", UUID(as_uuid=True)),
+    column("name", String),
+    column("description", String),
+    column("category_id", UUID(as_uuid=True)),
+    column("price", Numeric(precision=10, scale=2)),
+    column("stock", Integer),
+)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Splitting a stream of bytes into text lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    async for chunk in chunks:
+        *lines, tail = (tail + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail.rstrip("\r")
+
+
+class ProductImportService:
+    """Upserting products by name from CSV or NDJSON streams, loaded in chunks through COPY."""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self._updated_ids: list[uuid.UUID] = []
+
+    async def import_products(self, lines: AsyncIterator[str], format: str = "ndjson") -> ProductImportResult:
+        result = ProductImportResult()
+        chunk = {}
+
+        async for line_number, row in self._parse(lines, format, result):
+            try:
+                product = ProductCreate.model_validate(row)
+            except ValidationError as e:
+                detail = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+                result.errors.append(ProductImportError(line=line_number, detail=detail))
+                continue
+
+            if not 0 <= product.price < MAX_PRICE or not 0 <= product.stock <= MAX_STOCK:
+                result.errors.append(ProductImportError(line=line_number, detail="price or stock out of range"))
+                continue
+
+            duplicate = chunk.pop(product.name, None)
+            if duplicate:
+                # one upsert can't touch a row twice, the later line wins as it does across chunks
+                result.errors.append(ProductImportError(
+                    line=duplicate[0], detail=f"Product {product.name!r} is repeated on line {line_number}"
+                ))
+            chunk[product.name] = (line_number, uuid.uuid4(), product.name, product.description,
+                                   product.category_id, product.price, product.stock)
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await self._load_chunk(list(chunk.values()), result)
+                chunk = {}
+
+        if chunk:
+            await self._load_chunk(list(chunk.values()), result)
+
+        if result.created or result.updated:
+            await invalidate_tags(CATALOG_TAG, CATEGORIES_TAG, FACETS_TAG, PRICES_TAG)
+        for start in range(0, len(self._updated_ids), IMPORT_CHUNK_SIZE):
+            await invalidate_tags(*map(product_tag, self._updated_ids[start:start + IMPORT_CHUNK_SIZE]))
+
+        result.errors.sort(key=lambda error: error.line)
+        return result
+
+    @staticmethod
+    async def _parse(lines: AsyncIterator[str], format: str, result: ProductImportResult):
+        if format == "csv":
+            async for line_number, row in _parse_csv(lines):
+                yield line_number, row
+            return
+
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+
+            try:
+                row = json.loads(line)
+            except ValueError:
+                result.errors.append(ProductImportError(line=line_number, detail="Invalid JSON"))
+                continue
+            yield line_number, row
+
+    async def _load_chunk(self, records: list[tuple], result: ProductImportResult) -> None:
+        try:
+            await self._merge_chunk(records, result)
+        except (DBAPIError, PostgresError) as e:
+            await self.db.rollback()
+            detail = str(getattr(e, "orig", e))
+            result.errors.extend(ProductImportError(line=record[0], detail=detail) for record in records)
+
+    async def _merge_chunk(self, records: list[tuple], result: ProductImportResult) -> None:
+        """COPY the chunk into a temporary staging table and merge it into products in one statement."""
+        connection = await self.db.connection()
+        await connection.execute(text(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS product_import_staging "
+            "(line integer, id uuid, name varchar, description varchar, category_id uuid, "
+            "price numeric(10, 2), stock integer) ON COMMIT DELETE ROWS"
+        ))
+
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "product_import_staging", records=records, columns=[c.name for c in staging.columns]
+        )
+
+        unknown_categories = await connection.execute(
+            select(staging.c.line, staging.c.category_id)
+            .where(~select(ProductCategory.id).where(ProductCategory.id == staging.c.category_id).exists())
+        )
+        for line, category_id in unknown_categories:
+            result.errors.append(ProductImportError(line=line, detail=f"Category {category_id} not found"))
+
+        rows = select(
+            staging.c.id, staging.c.name, staging.c.description, staging.c.category_id, staging.c.price,
+            staging.c.stock,
+        ).join(ProductCategory, ProductCategory.id == staging.c.category_id)
+        upsert = insert(Product).from_select(
+            ["id", "name", "description", "category_id", "price", "stock"], rows
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[Product.name],
+            set_={
+                "description": upsert.excluded.description,
+                "category_id": upsert.excluded.category_id,
+                "price": upsert.excluded.price,
+                "stock": upsert.excluded.stock,
+                "updated_at": func.now(),
+            },
+        ).returning(Product.id, literal_column("xmax = 0").label("inserted"))
+
+        for product_id, inserted in await connection.execute(upsert):
+            if inserted:
+                result.created += 1
+            else:
+                result.updated += 1
+                self._updated_ids.append(product_id)
+
+        await self.db.commit()
+
+
+async def _parse_csv(lines: AsyncIterator[str]):
+    """CSV records with the line they start on, a quoted field can span several lines."""
+    header: Optional[list[str]] = None
+    record: list[str] = []
+    line_number = start = 0
+
+    async for line in lines:
+        line_number += 1
+        if not record:
+            if not line.strip():
+                continue
+            start = line_number
+        record.append(line)
+        if sum(part.count('"') for part in record) % 2:
+            # inside a quoted field, the record goes on on the next line
+            continue
+
+        values = next(csv.reader(["\n".join(record)]))
+        record = []
+        if header is None:
+            header = values
+            continue
+        yield start, {key: value or None for key, value in zip(header, values)}
+
+    if record and header is not None:
+        values = next(csv.reader(["\n".join(record)]))
+        yield start, {key: value or None for key, value in zip(header, values)}
+
+
+async def _read_file(path: str, chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while chunk := await asyncio.to_thread(file.read, chunk_size):
+            yield chunk
+
+
+async def main(path: str, format: str) -> None:
+    async with async_session() as db:
+        result = await ProductImportService(db).import_products(iter_lines(_read_file(path)), format=format)
+    print(result.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import products from a CSV or NDJSON file")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["ndjson", "csv"])
+    args = parser.parse_args()
+
+    asyncio.run(main(args.path, args.format or ("csv" if args.path.endswith(".csv") else "ndjson")))
@@ -1,8 +1,10 @@
 import uuid
 
-from sqlalchemy import Column, String, Integer, Boolean, ForeignKey, Numeric
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import (Column, String, Integer, Boolean, ForeignKey, Numeric, Computed, DDL, Index, event, func,
+                        insert, literal, select, text)
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
 
 from src.database import Base
 from src.mixin_models import TimestampMixin
@@ -11,27 +13,50 @@ from src.mixin_models import TimestampMixin
 class Product(Base, TimestampMixin):
     """Product model representing items in the store."""
     __tablename__ = "product"
+    __table_args__ = (
+        Index("ix_product_active_created_at_id", "created_at", "id", postgresql_where=text("is_active")),
+        Index("ix_product_active_price_id", "price", "id", postgresql_where=text("is_active")),
+        Index("ix_product_active_category_created_at_id", "category_id", "created_at", "id",
+              postgresql_where=text("is_active")),
+        Index("ix_product_active_category_price_id", "category_id", "price", "id", postgresql_where=text("is_active")),
+        Index("ix_product_active_category_name", "category_id", "name", postgresql_where=text("is_active")),
+        Index("ix_product_updated_at_id", "updated_at", "id"),
+        Index("ix_product_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_product_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     name = Column(String, nullable=False, unique=True)
     description = Column(String, nullable=True)
-    category_id = Column(UUID(as_uuid=True), ForeignKey("product_category.id"), nullable=False)
+    category_id = Column(UUID(as_uuid=True), ForeignKey("product_category.id"), nullable=False, index=True)
     category_rel = relationship("ProductCategory", back_populates="products")
     price = Column(Numeric(precision=10, scale=2))
     stock = Column(Integer, nullable=False)
     reserved = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+        persisted=True,
+    )))
 
     discounts = relationship("ProductDiscount", back_populates="product")
 
-    @property
+    @hybrid_property
     def available_stock(self):
-        return self.stock - self.reserved
+        return self.stock - (self.reserved or 0)
+
+    @available_stock.expression
+    def available_stock(cls):
+        return cls.stock - func.coalesce(cls.reserved, 0)
 
     def __str__(self):
         return f"{self.name}, price:{self.price}"
 
 
+event.listen(Product.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
 class ProductCategory(Base, TimestampMixin):
     __tablename__ = "product_category"
 
@@ -54,8 +79,69 @@ class ProductCategory(Base, TimestampMixin):
         return f"{self.name}"
 
 
+class ProductCategoryClosure(Base):
+    """Every ancestor/descendant pair of the category tree, a category is its own ancestor at depth 0."""
+    __tablename__ = "product_category_closure"
+
+    ancestor_id = Column(UUID(as_uuid=True), ForeignKey("product_category.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(UUID(as_uuid=True), ForeignKey("product_category.id", ondelete="CASCADE"), primary_key=True,
+                           index=True)
+    depth = Column(Integer, nullable=False)
+
+
+@event.listens_for(ProductCategory, "after_insert")
+def add_category_paths(mapper, connection, target):
+    """Linking a new category to itself and to every ancestor of its parent."""
+    closure = ProductCategoryClosure.__table__
+    category_id = literal(target.id, UUID(as_uuid=True))
+
+    paths = select(category_id, category_id, literal(0))
+    if target.parent_id is not None:
+        paths = paths.union_all(
+            select(closure.c.ancestor_id, category_id, closure.c.depth + 1)
+            .where(closure.c.descendant_id == target.parent_id)
+        )
+
+    connection.execute(insert(closure).from_select(["ancestor_id", "descendant_id", "depth"], paths))
+
+
+@event.listens_for(ProductCategory, "after_update")
+def move_category_paths(mapper, connection, target):
+    """Re-linking the subtree of a category when it gets a new parent."""
+    closure = ProductCategoryClosure.__table__
+
+    current_parent_id = connection.scalar(
+        select(closure.c.ancestor_id).where(closure.c.descendant_id == target.id, closure.c.depth == 1)
+    )
+    if current_parent_id == target.parent_id:
+        return
+
+    subtree = select(closure.c.descendant_id).where(closure.c.ancestor_id == target.id)
+    if target.parent_id is not None and connection.scalar(
+        select(closure.c.descendant_id).where(closure.c.ancestor_id == target.id,
+                                              closure.c.descendant_id == target.parent_id)
+    ):
+        raise ValueError("Category can not be moved under its own subcategory")
+
+    connection.execute(
+        closure.delete().where(closure.c.descendant_id.in_(subtree), closure.c.ancestor_id.not_in(subtree))
+    )
+
+    if target.parent_id is not None:
+        above = closure.alias("above")
+        below = closure.alias("below")
+        connection.execute(insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1)
+            .where(above.c.descendant_id == target.parent_id, below.c.ancestor_id == target.id)
+        ))
+
+
 class ProductDiscount(Base, TimestampMixin):
     __tablename__ = "product_discount"
+    __table_args__ = (
+        Index("ix_product_discount_product_id_created_at", "product_id", "created_at"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     product_id = Column(UUID(as_uuid=True), ForeignKey("product.id"), nullable=False)
@@ -1,25 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from decimal import Decimal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi_pagination import Page
+from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
+from typing import List, Literal, Optional
 from uuid import UUID
 
-from fastapi_cache.decorator import cache
-
 from starlette import status
 
-from src.database import get_db, custom_cache_key
-from src.exceptions import ProductAlreadyExistsException
-from src.products.schemas import ProductCreate, ProductUpdate, ProductResponse, ProductWithDiscountResponse
+from src.cache import cached, cached_response
+from src.config import CACHE_STALE_TTL
+from src.database import get_db
+from src.exceptions import BadRequestException, ProductAlreadyExistsException
+from src.products.schemas import (ProductCreate, ProductUpdate, ProductResponse, ProductWithDiscountResponse,
+                                 ProductDetailResponse, ProductSuggestion, ProductFacetsResponse, ProductImportResult,
+                                 ProductBulkUpdate, ProductBulkUpdateResult)
+from src.products.cache import facets_tags, product_detail_key, product_detail_tags, product_list_tags
+from src.products.exports import ProductExportService
+from src.products.imports import ProductImportService, iter_lines
 from src.products.services import ProductService, ProductDiscountService
+from src.schemas import CursorPage
 
 
 product_router = APIRouter()
 
+PRODUCT_BATCH_MAX_SIZE = 200
+
 
 @product_router.get("/", response_model=Page[ProductWithDiscountResponse], status_code=status.HTTP_200_OK)
-@cache(expire=60, key_builder=custom_cache_key)
+@cached(tags=product_list_tags, stale_ttl=CACHE_STALE_TTL)
 async def list_products(
+    request: Request,
     db: AsyncSession = Depends(get_db),
     page: int = 1,
     size: int = 10
@@ -29,16 +43,158 @@ async def list_products(
 
 
 @product_router.get("/filter/", response_model=Page[ProductWithDiscountResponse], status_code=status.HTTP_200_OK)
-@cache(expire=60, key_builder=custom_cache_key)
+@cached(tags=product_list_tags, stale_ttl=CACHE_STALE_TTL)
 async def filter_products(
+    request: Request,
     category_id: Optional[UUID] = None,
     subcategory_id: Optional[UUID] = None,
+    min_price: Optional[Decimal] = Query(None, ge=0),
+    max_price: Optional[Decimal] = Query(None, ge=0),
+    sort: Optional[Literal["price", "-price", "newest", "name"]] = None,
     db: AsyncSession = Depends(get_db),
     page: int = 1,
     size: int = 10
 ):
     service = ProductService(db)
-    return await service.filter_products(category_id=category_id, subcategory_id=subcategory_id, page=page, size=size)
+    return await service.filter_products(
+        category_id=category_id, subcategory_id=subcategory_id, page=page, size=size,
+        min_price=min_price, max_price=max_price, sort=sort,
+    )
+
+
+@product_router.get("/cursor/", response_model=CursorPage[ProductWithDiscountResponse],
+                    status_code=status.HTTP_200_OK)
+@cached(tags=product_list_tags)
+async def list_products_by_cursor(
+    request: Request,
+    category_id: Optional[UUID] = None,
+    subcategory_id: Optional[UUID] = None,
+    cursor: Optional[str] = None,
+    size: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    service = ProductService(db)
+    return await service.get_products_by_cursor(
+        cursor=cursor, size=size, category_id=category_id, subcategory_id=subcategory_id
+    )
+
+
+@product_router.get("/search/", response_model=Page[ProductWithDiscountResponse], status_code=status.HTTP_200_OK)
+@cached(tags=product_list_tags)
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    db: AsyncSession = Depends(get_db),
+    page: int = 1,
+    size: int = 10
+):
+    service = ProductService(db)
+    return await service.search_products(q=q, page=page, size=size)
+
+
+@product_router.get("/suggest/", response_model=List[ProductSuggestion], status_code=status.HTTP_200_OK)
+@cached(expire=30)
+async def suggest_products(
+    request: Request,
+    prefix: str = Query(..., min_length=2),
+    limit: int = Query(10, ge=1, le=20),
+    db: AsyncSession = Depends(get_db)
+):
+    service = ProductService(db)
+    return await service.suggest_products(prefix=prefix, limit=limit)
+
+
+@product_router.get("/facets/", response_model=ProductFacetsResponse, status_code=status.HTTP_200_OK)
+@cached(tags=facets_tags)
+async def product_facets(
+    request: Request,
+    category_id: Optional[UUID] = None,
+    subcategory_id: Optional[UUID] = None,
+    min_price: Optional[Decimal] = Query(None, ge=0),
+    max_price: Optional[Decimal] = Query(None, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    service = ProductService(db)
+    return await service.get_facets(
+        category_id=category_id, subcategory_id=subcategory_id, min_price=min_price, max_price=max_price
+    )
+
+
+@product_router.get("/batch/", response_model=List[ProductDetailResponse], status_code=status.HTTP_200_OK)
+async def get_products_batch(
+    request: Request,
+    ids: List[str] = Query(..., description="Product ids, repeated or comma separated"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Details of up to 200 products in the requested order, the unknown ids are skipped."""
+    try:
+        product_ids = [UUID(product_id) for value in ids for product_id in value.split(",") if product_id]
+    except ValueError:
+        raise BadRequestException(detail="Invalid product id")
+    if len(product_ids) > PRODUCT_BATCH_MAX_SIZE:
+        raise BadRequestException(detail=f"At most {PRODUCT_BATCH_MAX_SIZE} ids can be requested at once")
+
+    service = ProductService(db)
+    bodies = await service.get_cached_product_details(product_ids)
+    return cached_response(b"[" + b",".join(bodies) + b"]", request.headers.get("If-None-Match"))
+
+
+@product_router.get("/export/", response_class=StreamingResponse, status_code=status.HTTP_200_OK)
+async def export_products(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    updated_since: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Whole catalog as NDJSON or CSV, updated_since limits it to the products changed since the last sync."""
+    filename = f"products.{format}" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        # a .gz file download, not a transfer encoding clients would undo before saving it
+        media_type = "application/gzip"
+    else:
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+
+    service = ProductExportService(db)
+    return StreamingResponse(
+        service.export(format=format, compress=gzip, updated_since=updated_since),
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+@product_router.post("/import/", response_model=ProductImportResult, status_code=status.HTTP_200_OK)
+async def import_products(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db: AsyncSession = Depends(get_db)
+):
+    """Streaming upsert of products by name, the body is read line by line and loaded in chunks."""
+    service = ProductImportService(db)
+    return await service.import_products(iter_lines(request.stream()), format=format)
+
+
+@product_router.put("/bulk/", response_model=ProductBulkUpdateResult, status_code=status.HTTP_200_OK)
+async def bulk_update_products(
+    body: ProductBulkUpdate,
+    db: AsyncSession = Depends(get_db)
+):
+    service = ProductService(db)
+    return await service.bulk_update_products(body.items)
+
+
+@product_router.get("/{product_id}/", response_model=ProductDetailResponse, status_code=status.HTTP_200_OK)
+@cached(tags=product_detail_tags, key_builder=product_detail_key)
+async def get_product(
+    request: Request,
+    product_id: UUID,
+    db: AsyncSession = Depends(get_db)
+):
+    service = ProductService(db)
+    try:
+        return await service.get_product_detail(product_id)
+    except NoResultFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
 
 
 @product_router.put("/{product_id}/price/", response_model=ProductResponse, status_code=status.HTTP_200_OK)
@@ -54,7 +210,7 @@ async def update_product_price(
 @product_router.post("/{product_id}/discount/", response_model=ProductResponse, status_code=status.HTTP_201_CREATED)
 async def create_discount(
     product_id: UUID,
-    discount_percentage: int,
+    discount_percentage: int = Query(..., ge=0, le=100),
     db: AsyncSession = Depends(get_db)
 ):
     discount_service = ProductDiscountService(db)
@@ -1,4 +1,5 @@
 from uuid import UUID
+from datetime import datetime
 from decimal import Decimal
 from typing import Optional
 
@@ -32,5 +33,71 @@ class ProductResponse(ProductCreate):
     id: UUID
 
 
-class ProductWithDiscountResponse(ProductCreate):
+class ProductWithDiscountResponse(ProductResponse):
     discounts: Optional[list[ProductDiscountResponse]] = []
+
+
+class ProductDetailResponse(ProductWithDiscountResponse):
+    available_stock: int
+
+
+class ProductSuggestion(TunedModel):
+    id: UUID
+    name: str
+
+
+class CategoryFacet(TunedModel):
+    category_id: UUID
+    count: int
+
+
+class PriceRangeFacet(TunedModel):
+    min_price: Optional[Decimal] = None
+    max_price: Optional[Decimal] = None
+    count: int
+
+
+class ProductFacetsResponse(TunedModel):
+    total: int
+    categories: list[CategoryFacet] = []
+    price_ranges: list[PriceRangeFacet] = []
+
+
+class ProductImportError(BaseModel):
+    line: int
+    detail: str
+
+
+class ProductImportResult(BaseModel):
+    created: int = 0
+    updated: int = 0
+    errors: list[ProductImportError] = []
+
+
+class ProductBulkUpdateItem(BaseModel):
+    product_id: UUID
+    price: Optional[Decimal] = None
+    stock: Optional[int] = None
+
+
+class ProductBulkUpdate(BaseModel):
+    items: list[ProductBulkUpdateItem]
+
+
+class ProductBulkUpdateResult(BaseModel):
+    updated: int
+    not_found: list[UUID] = []
+
+
+class ProductExportRow(BaseModel):
+    id: UUID
+    name: str
+    description: Optional[str] = None
+    category_id: UUID
+    price: Optional[Decimal] = None
+    base_price: Optional[Decimal] = None
+    discount_percentage: Optional[int] = None
+    stock: int
+    available_stock: int
+    is_active: Optional[bool] = None
+    updated_at: Optional[datetime] = None
@@ -1,62 +1,260 @@
+import base64
+import binascii
+import json
+from datetime import datetime
 from decimal import Decimal
 
+from fastapi_cache import FastAPICache
 from fastapi_pagination import Page, Params
+from redis.exceptions import RedisError
+from sqlalchemy import (Integer, Numeric, Row, Select, any_, bindparam, case, cast, column, func, true, tuple_, update,
+                        values)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 from uuid import UUID
 from typing import List, Optional
 
-from src.exceptions import ProductAlreadyExistsException
-from src.products.models import Product, ProductCategory, ProductDiscount
-from src.products.schemas import ProductCreate, ProductUpdate, ProductWithDiscountResponse
+from src.cache import get_many, invalidate_tags, set_many
+from src.exceptions import BadRequestException, ProductAlreadyExistsException
+from src.products.cache import (CATALOG_TAG, FACETS_TAG, PRICES_TAG, add_cache_tags, category_tag,
+                                product_detail_cache_key, product_tag, stock_change_tags)
+from src.products.category_tree import category_tree_cache
+from src.products.models import Product, ProductDiscount
+from src.products.schemas import (ProductCreate, ProductUpdate, ProductResponse, ProductDiscountResponse,
+                                 ProductWithDiscountResponse, ProductDetailResponse, ProductSuggestion, ProductFacetsResponse,
+                                 CategoryFacet, PriceRangeFacet, ProductBulkUpdateItem, ProductBulkUpdateResult)
+from src.schemas import CursorPage
+
+
+PRICE_FACET_BOUNDARIES = (Decimal(50), Decimal(100), Decimal(250), Decimal(500), Decimal(1000))
+BULK_UPDATE_CHUNK_SIZE = 1000
+PRODUCT_SORT_ORDERS = {
+    "newest": (Product.created_at.desc(), Product.id.desc()),
+    "name": (Product.name, Product.id),
+}
+
+
+def encode_cursor(product: Product) -> str:
+    """Opaque cursor pointing right after the product in the (created_at, id) order."""
+    payload = json.dumps([product.created_at.isoformat(), str(product.id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        created_at, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), UUID(product_id)
+    except (binascii.Error, TypeError, ValueError):
+        raise BadRequestException(detail="Invalid cursor")
+
+
+async def reserve_stock(db: AsyncSession, product_id: UUID, quantity: int) -> bool:
+    """Moving the quantity into reserved in one conditional UPDATE, False if not enough of it is available."""
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.available_stock >= quantity)
+        .values(reserved=func.coalesce(Product.reserved, 0) + quantity, updated_at=func.now())
+        .returning(Product.category_id, Product.available_stock.label("available_stock"))
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return False
+
+    add_cache_tags(db, stock_change_tags(product_id, row.category_id, row.available_stock + quantity,
+                                         row.available_stock))
+    return True
+
+
+async def adjust_reserved_stock(db: AsyncSession, deltas: dict[UUID, int]) -> None:
+    """Reserving a positive and releasing a negative delta of every product in one UPDATE ... FROM unnest.
+
+    Nothing is checked here, the caller holds the product locks or releases what the ledger says was reserved.
+    """
+    changes = (
+        func.unnest(
+            bindparam("stock_product_ids", list(deltas), type_=ARRAY(PG_UUID(as_uuid=True))),
+            bindparam("stock_deltas", list(deltas.values()), type_=ARRAY(Integer)),
+        )
+        .table_valued(column("product_id", PG_UUID(as_uuid=True)), column("delta", Integer))
+        .render_derived(name="changes")
+    )
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == changes.c.product_id)
+        .values(reserved=func.coalesce(Product.reserved, 0) + changes.c.delta, updated_at=func.now())
+        .returning(Product.id, Product.category_id, Product.available_stock.label("available_stock"),
+                   changes.c.delta)
+        .execution_options(synchronize_session=False)
+    )
+    for row in result:
+        add_cache_tags(db, stock_change_tags(row.id, row.category_id, row.available_stock + row.delta,
+                                             row.available_stock))
 
 
 class ProductService:
     def __init__(self, db: AsyncSession):
         self.db = db
 
-    async def _get_data_pagination(self, page: int, size: int, query) -> Page:
-        products = await self.db.execute(query)
-        products = [product for product in products.scalars().all() if product.available_stock > 0]
+    async def _get_data_pagination(self, page: int, size: int, query, order_by=(Product.created_at, Product.id),
+                                   discounted: bool = False) -> Page:
+        """Counting and slicing the in-stock products of the query on the database side.
 
+        A query already passed through apply_discount, to filter or sort by the discounted price, is marked discounted.
+        """
+        query = query.where(Product.available_stock > 0)
         params = Params(page=page, size=size)
 
-        total = len(products)
-        start = (params.page - 1) * params.size
-        end = start + params.size
-        paginated_items = products[start:end]
+        total = await self.db.scalar(select(func.count()).select_from(query.subquery()))
 
-        for product in paginated_items:
-            await ProductDiscountService(self.db).apply_discount(product)
+        query = query.order_by(*order_by).limit(params.size).offset(
+            (params.page - 1) * params.size
+        )
+        if not discounted:
+            query = ProductDiscountService.apply_discount(query)
+        result = await self.db.execute(query)
+        items = [ProductDiscountService.to_response(row) for row in result.all()]
 
-        return Page.create(paginated_items, total=total, params=params)
+        return Page.create(items, total=total, params=params)
 
-    async def get_all_products_paginated(self, page: int = 1, size: int = 10) -> Page[Product]:
+    async def get_all_products_paginated(self, page: int = 1, size: int = 10) -> Page[ProductWithDiscountResponse]:
         """Getting a page with active products with discounts taken into account and available stock."""
-        query = select(Product).where(
-            Product.is_active == True
-        ).options(selectinload(Product.discounts))
+        query = select(Product).where(Product.is_active == True)
 
-        paginated_result = await self._get_data_pagination(page, size, query)
-        paginated_result.items = [ProductWithDiscountResponse.from_orm(product) for product in paginated_result.items]
-        return paginated_result
+        return await self._get_data_pagination(page, size, query)
 
-    async def filter_products(self, category_id: Optional[UUID] = None, subcategory_id: Optional[UUID] = None,
-                              page: int = 1, size: int = 10) -> Page[Product]:
-        """Product filtering by category and subcategory."""
-        query = select(Product).where(Product.is_active == True).options(selectinload(Product.discounts))
+    async def _filter_query(self, category_id: Optional[UUID] = None, subcategory_id: Optional[UUID] = None):
+        query = select(Product).where(Product.is_active == True)
 
         if category_id:
             query = query.where(Product.category_id == category_id)
 
         if subcategory_id:
-            query = query.join(ProductCategory, Product.category_rel).where(ProductCategory.parent_id == subcategory_id)
+            category_tree = await category_tree_cache.get(self.db)
+            query = query.where(Product.category_id.in_(category_tree.descendants(subcategory_id)))
+
+        return query
 
-        paginated_result = await self._get_data_pagination(page, size, query)
-        paginated_result.items = [ProductWithDiscountResponse.from_orm(product) for product in paginated_result.items]
-        return paginated_result
+    async def filter_products(self, category_id: Optional[UUID] = None, subcategory_id: Optional[UUID] = None,
+                              page: int = 1, size: int = 10, min_price: Optional[Decimal] = None,
+                              max_price: Optional[Decimal] = None,
+                              sort: Optional[str] = None) -> Page[ProductWithDiscountResponse]:
+        """Product filtering by category, any of its ancestor categories and discounted price range, in any sort order."""
+        query = await self._filter_query(category_id, subcategory_id)
+        if min_price is not None:
+            # a discount only lowers the price, so the base price bound is implied and can use the price indexes
+            query = query.where(Product.price >= min_price)
+
+        order_by = PRODUCT_SORT_ORDERS.get(sort, (Product.created_at, Product.id))
+        if min_price is None and max_price is None and sort not in ("price", "-price"):
+            # nothing depends on the discounted price, it is looked up for the rows of the page only
+            return await self._get_data_pagination(page, size, query, order_by=order_by)
+
+        query = ProductDiscountService.apply_discount(query)
+        final_price = query.selected_columns.final_price
+        if min_price is not None:
+            query = query.where(final_price >= min_price)
+        if max_price is not None:
+            query = query.where(final_price <= max_price)
+
+        if sort in ("price", "-price"):
+            order_by = (final_price.desc() if sort == "-price" else final_price, Product.id)
+
+        return await self._get_data_pagination(page, size, query, order_by=order_by, discounted=True)
+
+    async def get_products_by_cursor(self, cursor: Optional[str] = None, size: int = 10,
+                                     category_id: Optional[UUID] = None,
+                                     subcategory_id: Optional[UUID] = None) -> CursorPage:
+        """Keyset pagination over (created_at, id), every page costs the same regardless of its depth."""
+        query = await self._filter_query(category_id, subcategory_id)
+        query = query.where(Product.available_stock > 0)
+
+        if cursor:
+            query = query.where(tuple_(Product.created_at, Product.id) > tuple_(*decode_cursor(cursor)))
+
+        query = query.order_by(Product.created_at, Product.id).limit(size + 1)
+        result = await self.db.execute(ProductDiscountService.apply_discount(query))
+        rows = result.all()
+
+        next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            next_cursor = encode_cursor(rows[-1].Product)
+
+        items = [ProductDiscountService.to_response(row) for row in rows]
+        return CursorPage(items=items, size=size, next_cursor=next_cursor)
+
+    async def search_products(self, q: str, page: int = 1, size: int = 10) -> Page[ProductWithDiscountResponse]:
+        """Full-text search over product names and descriptions, best matches first."""
+        ts_query = func.websearch_to_tsquery("english", q)
+        query = select(Product).where(Product.is_active == True, Product.search_vector.op("@@")(ts_query))
+        rank = func.ts_rank(Product.search_vector, ts_query)
+
+        return await self._get_data_pagination(page, size, query, order_by=(rank.desc(), Product.id))
+
+    async def suggest_products(self, prefix: str, limit: int = 10) -> List[ProductSuggestion]:
+        """Active product names starting with the prefix, served by the trigram index on the name."""
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        query = (
+            select(Product.id, Product.name)
+            .where(Product.is_active == True, Product.name.ilike(pattern, escape="\\"))
+            .order_by(func.length(Product.name), Product.name)
+            .limit(limit)
+        )
+        result = await self.db.execute(query)
+        return [ProductSuggestion.model_validate(row) for row in result.all()]
+
+    async def get_facets(self, category_id: Optional[UUID] = None, subcategory_id: Optional[UUID] = None,
+                         min_price: Optional[Decimal] = None,
+                         max_price: Optional[Decimal] = None) -> ProductFacetsResponse:
+        """Counts of in-stock products per category and per discounted price range in one GROUPING SETS query.
+
+        The price range narrows the counts the same way it narrows filter_products.
+        """
+        query = await self._filter_query(category_id, subcategory_id)
+        if min_price is not None:
+            query = query.where(Product.price >= min_price)
+        query = ProductDiscountService.apply_discount(query.where(Product.available_stock > 0))
+        final_price = query.selected_columns.final_price
+        if min_price is not None:
+            query = query.where(final_price >= min_price)
+        if max_price is not None:
+            query = query.where(final_price <= max_price)
+        products = query.subquery()
+
+        price_bucket = case(
+            *[(products.c.final_price < boundary, number) for number, boundary in enumerate(PRICE_FACET_BOUNDARIES)],
+            else_=len(PRICE_FACET_BOUNDARIES),
+        )
+        buckets = select(products.c.category_id, price_bucket.label("price_bucket")).subquery()
+
+        facets = select(
+            func.grouping(buckets.c.category_id, buckets.c.price_bucket).label("grouping"),
+            buckets.c.category_id,
+            buckets.c.price_bucket,
+            func.count().label("count"),
+        ).group_by(
+            func.grouping_sets(tuple_(buckets.c.category_id), tuple_(buckets.c.price_bucket), tuple_())
+        )
+        result = await self.db.execute(facets)
+
+        response = ProductFacetsResponse(total=0)
+        for row in result.all():
+            if row.grouping == 1:
+                response.categories.append(CategoryFacet(category_id=row.category_id, count=row.count))
+            elif row.grouping == 2:
+                bounds = (None, *PRICE_FACET_BOUNDARIES, None)
+                response.price_ranges.append(PriceRangeFacet(
+                    min_price=bounds[row.price_bucket], max_price=bounds[row.price_bucket + 1], count=row.count
+                ))
+            else:
+                response.total = row.count
+
+        response.categories.sort(key=lambda facet: facet.count, reverse=True)
+        response.price_ranges.sort(key=lambda facet: facet.min_price or 0)
+        return response
 
     async def add_product(self, product_data: ProductCreate) -> Product:
         """Adding a new product with a check for existing products."""
@@ -86,6 +284,55 @@ class ProductService:
         await self.db.refresh(product)
         return product
 
+    async def bulk_update_products(self, items: List[ProductBulkUpdateItem]) -> ProductBulkUpdateResult:
+        """Price and stock update of many products, one UPDATE ... FROM (VALUES ...) per chunk in one transaction."""
+        changes_by_id = {item.product_id: item for item in items}
+        changes = list(changes_by_id.values())
+        updated = {}
+
+        for start in range(0, len(changes), BULK_UPDATE_CHUNK_SIZE):
+            chunk = values(
+                column("id", PG_UUID(as_uuid=True)),
+                column("price", Numeric(precision=10, scale=2)),
+                column("stock", Integer),
+                name="changes",
+            ).data([(item.product_id, item.price, item.stock)
+                    for item in changes[start:start + BULK_UPDATE_CHUNK_SIZE]])
+
+            query = (
+                update(Product)
+                .where(Product.id == chunk.c.id)
+                .values(
+                    # a chunk without any price or stock leaves an untyped all-NULL column in VALUES
+                    price=func.coalesce(cast(chunk.c.price, Product.price.type), Product.price),
+                    stock=func.coalesce(cast(chunk.c.stock, Integer), Product.stock),
+                    updated_at=func.now(),
+                )
+                .returning(Product.id, Product.category_id)
+                .execution_options(synchronize_session=False)
+            )
+            result = await self.db.execute(query)
+            updated.update(result.tuples().all())
+
+        await self.db.commit()
+
+        tags = {FACETS_TAG}
+        if any(item.price is not None for item in changes):
+            tags.add(PRICES_TAG)
+        if any(item.stock is not None for item in changes):
+            # stock changes can move products in or out of the lists
+            tags.update({CATALOG_TAG, *map(category_tag, set(updated.values()))})
+        await invalidate_tags(*tags)
+        # one purge per chunk keeps the script's key list bounded
+        updated_ids = list(updated)
+        for start in range(0, len(updated_ids), BULK_UPDATE_CHUNK_SIZE):
+            await invalidate_tags(*map(product_tag, updated_ids[start:start + BULK_UPDATE_CHUNK_SIZE]))
+
+        return ProductBulkUpdateResult(
+            updated=len(updated),
+            not_found=[product_id for product_id in changes_by_id if product_id not in updated],
+        )
+
     async def delete_product(self, product_id: UUID) -> None:
         """Product delete."""
         query = select(Product).where(Product.id == product_id)
@@ -98,18 +345,68 @@ class ProductService:
         await self.db.delete(product)
         await self.db.commit()
 
-    async def get_product_by_id(self, product_id: UUID) -> Product:
+    async def get_product_by_id(self, product_id: UUID) -> ProductWithDiscountResponse:
         """Receiving the product by its ID, taking into account the discount."""
-        query = select(Product).where(Product.id == product_id).options(selectinload(Product.discounts))
+        query = ProductDiscountService.apply_discount(select(Product).where(Product.id == product_id))
         result = await self.db.execute(query)
-        product = result.scalars().one_or_none()
+        row = result.one_or_none()
 
-        if product is None:
+        if row is None:
             raise NoResultFound(f"Product with ID {product_id} not found.")
 
-        await ProductDiscountService(self.db).apply_discount(product)
+        return ProductDiscountService.to_response(row)
 
-        return product
+    async def get_product_detail(self, product_id: UUID) -> ProductDetailResponse:
+        """Product with its discounted price and the stock left after reservations."""
+        products = await self.get_product_details([product_id])
+
+        if not products:
+            raise NoResultFound(f"Product with ID {product_id} not found.")
+
+        return products[0]
+
+    async def get_product_details(self, product_ids: List[UUID]) -> List[ProductDetailResponse]:
+        """Details of many products in one query, the products that do not exist are skipped."""
+        query = (
+            select(Product, Product.available_stock.label("available_stock"))
+            .where(Product.id == any_(bindparam("product_ids", product_ids, type_=ARRAY(PG_UUID(as_uuid=True)))))
+        )
+        result = await self.db.execute(ProductDiscountService.apply_discount(query))
+
+        return [
+            ProductDetailResponse(
+                **ProductDiscountService.to_response(row).model_dump(), available_stock=row.available_stock
+            )
+            for row in result.all()
+        ]
+
+    async def get_cached_product_details(self, product_ids: List[UUID]) -> List[bytes]:
+        """JSON bodies of the product details in the requested order, read through the per-product cache entries."""
+        product_ids = list(dict.fromkeys(product_ids))
+        keys = [product_detail_cache_key(product_id) for product_id in product_ids]
+        try:
+            version, bodies = await get_many(keys)
+        except RedisError:
+            version, bodies = None, [None] * len(keys)
+
+        bodies_by_id = {product_id: body for product_id, body in zip(product_ids, bodies) if body is not None}
+        missed = [product_id for product_id in product_ids if product_id not in bodies_by_id]
+        if missed:
+            coder = FastAPICache.get_coder()
+            fetched = {product.id: coder.encode(product) for product in await self.get_product_details(missed)}
+            bodies_by_id.update(fetched)
+
+            if version is not None and fetched:
+                try:
+                    await set_many(
+                        [(product_detail_cache_key(product_id), body, [product_tag(product_id)])
+                         for product_id, body in fetched.items()],
+                        version,
+                    )
+                except RedisError:
+                    pass
+
+        return [bodies_by_id[product_id] for product_id in product_ids if product_id in bodies_by_id]
 
     async def update_product(self, product_id: UUID, product_data: ProductUpdate) -> Product:
         """Update an existing product."""
@@ -143,14 +440,39 @@ class ProductDiscountService:
 
         discount = ProductDiscount(product_id=product_id, discount_percentage=discount_percentage)
         self.db.add(discount)
+        # the discounted price changes, incremental exports pick the product up by updated_at
+        product.updated_at = func.now()
         await self.db.commit()
         await self.db.refresh(discount)
         return discount
 
     @staticmethod
-    async def apply_discount(product: Product) -> None:
-        """Applying a discount to the product."""
-        if product.discounts:
-            latest_discount = max(product.discounts, key=lambda d: d.created_at)
-            discount_multiplier = Decimal(1) - Decimal(latest_discount.discount_percentage) / Decimal(100)
-            product.price = product.price * discount_multiplier
+    def apply_discount(query: Select) -> Select:
+        """Joining the latest discount of every product and the discounted price to a product query."""
+        latest_discount = (
+            select(ProductDiscount.id, ProductDiscount.discount_percentage)
+            .where(ProductDiscount.product_id == Product.id)
+            .order_by(ProductDiscount.created_at.desc())
+            .limit(1)
+            .lateral("latest_discount")
+        )
+        discount_percentage = func.coalesce(latest_discount.c.discount_percentage, 0)
+        final_price = func.round(Product.price * (100 - discount_percentage) / 100, 2)
+
+        return query.outerjoin(latest_discount, true()).add_columns(
+            latest_discount.c.id.label("discount_id"),
+            latest_discount.c.discount_percentage,
+            final_price.label("final_price"),
+        )
+
+    @staticmethod
+    def to_response(row: Row) -> ProductWithDiscountResponse:
+        """Building the response from a row of a query passed through apply_discount."""
+        product = ProductResponse.model_validate(row.Product).model_dump()
+        product["price"] = row.final_price
+
+        discounts = []
+        if row.discount_id is not None:
+            discounts.append(ProductDiscountResponse(id=row.discount_id, discount_percentage=row.discount_percentage))
+
+        return ProductWithDiscountResponse(**product, discounts=discounts)
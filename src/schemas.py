@@ -1,9 +1,22 @@
+from typing import Generic, Optional, Sequence, TypeVar
+
 from pydantic import BaseModel
 
 
+T = TypeVar("T")
+
+
 class TunedModel(BaseModel):
     class Config:
         """tells pydantic to convert even non dict obj to json"""
 
         from_attributes = True
         use_enum_values = True
+
+
+class CursorPage(BaseModel, Generic[T]):
+    """Page of a keyset pagination, next_cursor is None on the last page"""
+
+    items: Sequence[T]
+    size: int
+    next_cursor: Optional[str] = None
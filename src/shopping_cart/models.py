@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, Float, ForeignKey, DateTime, Enum, Boolean
+from sqlalchemy import (Column, String, Integer, Float, ForeignKey, DateTime, Enum, Boolean, Index,
+                        UniqueConstraint)
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
@@ -13,19 +14,18 @@ class Cart(Base, TimestampMixin):
     __tablename__ = "carts"
 
     cart_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("user.user_id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("user.user_id"), nullable=False, unique=True)
 
     user = relationship("User", back_populates="cart")
     items = relationship("CartItem", back_populates="cart", cascade="all, delete-orphan")
 
-    @property
-    def total_amount(self):
-        return sum(item.item_total for item in self.items)
-
 
 class CartItem(Base, TimestampMixin):
     """CartItem model representing each item in a cart."""
     __tablename__ = "cart_items"
+    __table_args__ = (
+        UniqueConstraint("cart_id", "product_id", name="uq_cart_items_cart_id_product_id"),
+    )
 
     cart_item_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     cart_id = Column(UUID(as_uuid=True), ForeignKey("carts.cart_id"), nullable=False)
@@ -35,6 +35,17 @@ class CartItem(Base, TimestampMixin):
     cart = relationship("Cart", back_populates="items")
     product = relationship("Product")
 
-    @property
-    def item_total(self):
-        return self.quantity * self.product.price
+
+class StockReservation(Base, TimestampMixin):
+    """Ledger of the quantities a user's cart holds in Product.reserved until expires_at."""
+    __tablename__ = "stock_reservation"
+    __table_args__ = (
+        UniqueConstraint("user_id", "product_id", name="uq_stock_reservation_user_id_product_id"),
+        Index("ix_stock_reservation_expires_at", "expires_at"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("user.user_id"), nullable=False)
+    product_id = Column(UUID(as_uuid=True), ForeignKey("product.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import uuid
+from datetime import timedelta
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import CART_RESERVATION_TTL, RESERVATION_SWEEP_INTERVAL
+from src.database import async_session
+from src.products.cache import add_cache_tags, stock_change_tags
+from src.products.models import Product
+from src.products.services import adjust_reserved_stock, reserve_stock
+from src.shopping_cart.models import StockReservation
+
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_SWEEP_BATCH_SIZE = 1000
+
+
+def reservation_expiry():
+    return func.now() + timedelta(seconds=CART_RESERVATION_TTL)
+
+
+async def reserve(db: AsyncSession, user_id: UUID, product_id: UUID, quantity: int) -> bool:
+    """Reserving the quantity on top of the user's reservation of the product and extending its expiry."""
+    if not await reserve_stock(db, product_id, quantity):
+        return False
+
+    upsert = insert(StockReservation).values(
+        id=uuid.uuid4(), user_id=user_id, product_id=product_id, quantity=quantity, expires_at=reservation_expiry()
+    )
+    await db.execute(upsert.on_conflict_do_update(
+        index_elements=[StockReservation.user_id, StockReservation.product_id],
+        set_={
+            "quantity": StockReservation.quantity + upsert.excluded.quantity,
+            "expires_at": upsert.excluded.expires_at,
+            "updated_at": func.now(),
+        },
+    ))
+    return True
+
+
+async def lock_reservations(db: AsyncSession, user_id: UUID, product_ids: Iterable[UUID]) -> dict[UUID, int]:
+    result = await db.execute(
+        select(StockReservation.product_id, StockReservation.quantity)
+        .where(StockReservation.user_id == user_id, StockReservation.product_id.in_(list(product_ids)))
+        .order_by(StockReservation.product_id)
+        .with_for_update()
+    )
+    return dict(result.all())
+
+
+async def set_reservations(db: AsyncSession, user_id: UUID, quantities: dict[UUID, int],
+                           reserved: dict[UUID, int]) -> None:
+    """Setting the user's reservations to the quantities, reserved is what the locked ledger held before."""
+    deltas = {product_id: quantity - reserved.get(product_id, 0) for product_id, quantity in quantities.items()}
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if deltas:
+        await adjust_reserved_stock(db, deltas)
+
+    released = [product_id for product_id, quantity in quantities.items() if not quantity]
+    if released:
+        await db.execute(delete(StockReservation).where(
+            StockReservation.user_id == user_id, StockReservation.product_id.in_(released)
+        ))
+
+    kept = [(product_id, quantity) for product_id, quantity in quantities.items() if quantity]
+    if kept:
+        upsert = insert(StockReservation).values([
+            {"id": uuid.uuid4(), "user_id": user_id, "product_id": product_id, "quantity": quantity,
+             "expires_at": reservation_expiry()}
+            for product_id, quantity in kept
+        ])
+        await db.execute(upsert.on_conflict_do_update(
+            index_elements=[StockReservation.user_id, StockReservation.product_id],
+            set_={"quantity": upsert.excluded.quantity, "expires_at": upsert.excluded.expires_at,
+                  "updated_at": func.now()},
+        ))
+
+
+async def lock_products(db: AsyncSession, product_ids: Iterable[UUID], skip_locked: bool = False) -> list[UUID]:
+    """Locking the products in id order, every stock change takes the product locks before the ledger rows."""
+    result = await db.execute(
+        select(Product.id)
+        .where(Product.id.in_(list(product_ids)))
+        .order_by(Product.id)
+        .with_for_update(skip_locked=skip_locked)
+    )
+    return list(result.scalars())
+
+
+async def release(db: AsyncSession, user_id: UUID, product_ids: Optional[Iterable[UUID]] = None) -> dict[UUID, int]:
+    """Deleting the user's reservations, of the given products or all of them, and releasing what they held."""
+    if product_ids is None:
+        product_ids = await db.scalars(
+            select(StockReservation.product_id).where(StockReservation.user_id == user_id)
+        )
+    product_ids = await lock_products(db, product_ids)
+
+    result = await db.execute(
+        delete(StockReservation)
+        .where(StockReservation.user_id == user_id, StockReservation.product_id.in_(product_ids))
+        .returning(StockReservation.product_id, StockReservation.quantity)
+    )
+    released = dict(result.all())
+    if released:
+        await adjust_reserved_stock(db, {product_id: -quantity for product_id, quantity in released.items()})
+    return released
+
+
+async def release_expired(db: AsyncSession, batch_size: int = RESERVATION_SWEEP_BATCH_SIZE) -> int:
+    """Releasing a batch of expired reservations, returns how many were released.
+
+    The batch is picked through the expires_at index and its products are locked in id order with SKIP LOCKED
+    before the ledger rows are deleted, so sweepers of several workers share the work and a product a cart is
+    changing meanwhile is left for the next sweep. The expiry is checked again under the lock.
+    """
+    expired = (await db.execute(
+        select(StockReservation.id, StockReservation.product_id)
+        .where(StockReservation.expires_at <= func.now())
+        .order_by(StockReservation.expires_at)
+        .limit(batch_size)
+    )).all()
+    locked = set(await lock_products(db, {row.product_id for row in expired}, skip_locked=True))
+
+    deleted = (
+        delete(StockReservation)
+        .where(StockReservation.id.in_([row.id for row in expired if row.product_id in locked]),
+               StockReservation.expires_at <= func.now())
+        .returning(StockReservation.product_id, StockReservation.quantity)
+        .cte("deleted")
+    )
+    released = (
+        select(deleted.c.product_id, func.sum(deleted.c.quantity).label("quantity"), func.count().label("count"))
+        .group_by(deleted.c.product_id)
+        .cte("released")
+    )
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == released.c.product_id)
+        .values(reserved=func.coalesce(Product.reserved, 0) - released.c.quantity, updated_at=func.now())
+        .returning(Product.id, Product.category_id, Product.available_stock.label("available_stock"),
+                   released.c.quantity, released.c.count)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    for row in rows:
+        add_cache_tags(db, stock_change_tags(row.id, row.category_id, row.available_stock - row.quantity,
+                                             row.available_stock))
+    await db.commit()
+    return sum(row.count for row in rows)
+
+
+async def sweep_reservations_forever(interval: float = RESERVATION_SWEEP_INTERVAL) -> None:
+    """Background release of the expired reservations, drains them every interval seconds."""
+    while True:
+        try:
+            async with async_session() as db:
+                while await release_expired(db) == RESERVATION_SWEEP_BATCH_SIZE:
+                    pass
+        except SQLAlchemyError:
+            logger.warning("Reservation sweep failed", exc_info=True)
+        await asyncio.sleep(interval)
@@ -1,25 +1,58 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, Query, Response, status, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
 from uuid import UUID
 
 from src.auth.models import User
 from src.database import get_db
-from src.shopping_cart.services import CartService
+from src.exceptions import BadRequestException
+from src.shopping_cart.schemas import CartBatchResponse, CartLineUpdate, CartResponse
+from src.shopping_cart.services import get_cart_service
 from src.auth.services import get_current_user
 
 
 cart_router = APIRouter()
 
+CART_BATCH_MAX_SIZE = 200
+
+
+@cart_router.get("/", response_model=CartResponse, status_code=status.HTTP_200_OK)
+async def get_cart(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Cart items with their discounted unit prices, line totals and the cart total."""
+    service = get_cart_service(db, current_user.user_id)
+    body = await service.get_cached_cart_view()
+    return Response(content=body, media_type="application/json", headers={"Cache-Control": "private, no-cache"})
+
+
+@cart_router.patch("/", response_model=CartBatchResponse, status_code=status.HTTP_200_OK)
+async def update_cart(
+    changes: List[CartLineUpdate],
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Setting the quantities of many lines in one transaction, returns the cart and the lines short of stock."""
+    if len(changes) > CART_BATCH_MAX_SIZE:
+        raise BadRequestException(detail=f"At most {CART_BATCH_MAX_SIZE} lines can be changed at once")
+
+    service = get_cart_service(db, current_user.user_id)
+    return await service.apply_changes(changes)
+
 
 @cart_router.post("/add/{product_id}", status_code=status.HTTP_201_CREATED)
 async def add_to_cart(
     product_id: UUID,
-    quantity: int,
+    quantity: int = Query(..., gt=0),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    service = CartService(db, current_user.user_id)
-    return await service.add_product_to_cart(product_id, quantity)
+    service = get_cart_service(db, current_user.user_id)
+    try:
+        return await service.add_product_to_cart(product_id, quantity)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
 @cart_router.delete("/remove/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -28,16 +61,19 @@ async def remove_from_cart(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    service = CartService(db, current_user.user_id)
+    service = get_cart_service(db, current_user.user_id)
     await service.remove_product_from_cart(product_id)
 
 
 @cart_router.put("/update/{product_id}", status_code=status.HTTP_200_OK)
 async def update_cart_item(
     product_id: UUID,
-    quantity: int,
+    quantity: int = Query(..., gt=0),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    service = CartService(db, current_user.user_id)
-    return await service.update_product_quantity(product_id, quantity)
+    service = get_cart_service(db, current_user.user_id)
+    try:
+        return await service.update_product_quantity(product_id, quantity)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -0,0 +1,37 @@
+from decimal import Decimal
+from typing import List
+from uuid import UUID
+
+from pydantic import Field
+
+from src.schemas import TunedModel
+
+
+class CartLineUpdate(TunedModel):
+    product_id: UUID
+    quantity: int = Field(..., ge=0)
+
+
+class CartLineResponse(TunedModel):
+    product_id: UUID
+    name: str
+    quantity: int
+    base_price: Decimal
+    discount_percentage: int
+    unit_price: Decimal
+    line_total: Decimal
+
+
+class CartResponse(TunedModel):
+    items: List[CartLineResponse] = []
+    total: Decimal = Decimal(0)
+
+
+class CartLineError(TunedModel):
+    product_id: UUID
+    detail: str
+
+
+class CartBatchResponse(TunedModel):
+    cart: CartResponse
+    errors: List[CartLineError] = []
@@ -1,10 +1,52 @@
+import asyncio
+import logging
+import uuid
+from typing import List
 from uuid import UUID
 
-from sqlalchemy import select
+from redis.exceptions import RedisError
+from fastapi_cache import FastAPICache
+from sqlalchemy import Integer, Select, bindparam, column, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID, insert
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import CART_FLUSH_INTERVAL, CART_STORE, CART_VIEW_CACHE_TTL
+from src.database import async_session, redis_cache_conn, redis_conn
+from src.exceptions import ProductNotFoundException
 from src.products.models import Product
+from src.products.services import ProductDiscountService
 from src.shopping_cart.models import Cart, CartItem
+from src.shopping_cart.reservations import lock_reservations, release, reserve, set_reservations
+from src.shopping_cart.schemas import (CartBatchResponse, CartLineError, CartLineResponse, CartLineUpdate,
+                                       CartResponse)
+
+
+logger = logging.getLogger(__name__)
+
+CART_KEY_PREFIX = "cart"
+CART_DIRTY_KEY = f"{CART_KEY_PREFIX}:dirty"
+CART_FLUSH_BATCH_SIZE = 500
+CART_VIEW_KEY_PREFIX = "cart-view"
+
+# removes the item and returns its quantity, 0 if it was not in the cart
+_remove_item_script = redis_conn.register_script("""
+local quantity = redis.call('HGET', KEYS[1], ARGV[1])
+if not quantity then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+return tonumber(quantity)
+""")
+
+# sets the quantity of an item already in the cart, 0 if it is not there
+_update_item_script = redis_conn.register_script("""
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+""")
 
 
 class CartService:
@@ -25,58 +67,377 @@ class CartService:
         return cart
 
     async def add_product_to_cart(self, product_id: UUID, quantity: int = 1) -> CartItem:
-        cart = await self.get_or_create_cart()
+        """Reserving the stock and upserting the cart and its item, in one transaction."""
+        if not await reserve(self.db, self.user_id, product_id, quantity):
+            await self._reservation_failed(product_id)
 
-        product = await self.db.execute(select(Product).where(Product.id == product_id))
-        product = product.scalars().first()
+        cart = (
+            insert(Cart)
+            .values(cart_id=uuid.uuid4(), user_id=self.user_id)
+            .on_conflict_do_update(index_elements=[Cart.user_id], set_={"updated_at": func.now()})
+            .returning(Cart.cart_id)
+            .cte("cart")
+        )
+        item = insert(CartItem).from_select(
+            ["cart_item_id", "cart_id", "product_id", "quantity"],
+            select(literal(uuid.uuid4(), PG_UUID(as_uuid=True)), cart.c.cart_id,
+                   literal(product_id, PG_UUID(as_uuid=True)), literal(quantity)),
+        )
+        item = (
+            item.on_conflict_do_update(
+                index_elements=[CartItem.cart_id, CartItem.product_id],
+                set_={"quantity": CartItem.quantity + item.excluded.quantity, "updated_at": func.now()},
+            )
+            .returning(CartItem)
+            .add_cte(cart)
+            .execution_options(populate_existing=True)
+        )
+        cart_item = (await self.db.scalars(item)).one()
 
-        if product.stock < quantity:
-            raise ValueError("Not enough stock available")
+        await self.db.commit()
+        await forget_cart_view(self.user_id)
+        return cart_item
 
-        product.stock -= quantity
+    async def _reservation_failed(self, product_id: UUID) -> None:
+        """Rolling back a refused reservation, the product is either missing or short of stock."""
+        await self.db.rollback()
+        if await self.db.scalar(select(Product.id).where(Product.id == product_id)) is None:
+            raise ProductNotFoundException()
+        raise ValueError("Not enough stock available")
+
+    async def remove_product_from_cart(self, product_id: UUID) -> None:
+        cart = await self.get_or_create_cart()
 
         cart_item = await self.db.execute(
             select(CartItem).where(CartItem.cart_id == cart.cart_id, CartItem.product_id == product_id))
         cart_item = cart_item.scalars().first()
 
         if cart_item:
-            cart_item.quantity += quantity
-        else:
-            cart_item = CartItem(cart_id=cart.cart_id, product_id=product_id, quantity=quantity)
-            self.db.add(cart_item)
+            await release(self.db, self.user_id, [product_id])
+            await self.db.delete(cart_item)
+            await self.db.commit()
+            await forget_cart_view(self.user_id)
+
+    async def update_product_quantity(self, product_id: UUID, quantity: int) -> CartItem:
+        """Setting the line's quantity and its reservation in one transaction, an increase needs available stock."""
+        cart_item = await self.db.execute(
+            select(CartItem).join(Cart).where(Cart.user_id == self.user_id, CartItem.product_id == product_id)
+        )
+        cart_item = cart_item.scalars().first()
+        if not cart_item:
+            raise ValueError("Product not found in cart")
 
+        await self._set_reservation(product_id, quantity)
+        cart_item.quantity = quantity
         await self.db.commit()
+        await forget_cart_view(self.user_id)
         await self.db.refresh(cart_item)
         return cart_item
 
-    async def remove_product_from_cart(self, product_id: UUID) -> None:
-        cart = await self.get_or_create_cart()
+    async def _set_reservation(self, product_id: UUID, quantity: int) -> None:
+        """Locking the product and then the reservation, as apply_changes does, and setting it to the quantity."""
+        available = await self.db.scalar(
+            select(Product.available_stock).where(Product.id == product_id).with_for_update()
+        )
+        reserved = await lock_reservations(self.db, self.user_id, [product_id])
+        if available is None or quantity - reserved.get(product_id, 0) > available:
+            await self.db.rollback()
+            raise ValueError("Not enough stock available")
+        await set_reservations(self.db, self.user_id, {product_id: quantity}, reserved)
 
-        cart_item = await self.db.execute(
-            select(CartItem).where(CartItem.cart_id == cart.cart_id, CartItem.product_id == product_id))
-        cart_item = cart_item.scalars().first()
+    async def get_items(self) -> dict[UUID, int]:
+        """Quantities by product of the user's cart."""
+        result = await self.db.execute(
+            select(CartItem.product_id, CartItem.quantity).join(Cart).where(Cart.user_id == self.user_id)
+        )
+        return dict(result.all())
 
-        if cart_item:
-            product = await self.db.execute(select(Product).where(Product.id == product_id))
-            product = product.scalars().first()
+    async def clear(self) -> None:
+        """Deleting the user's cart with its items, committed with the rest of the transaction."""
+        cart_ids = select(Cart.cart_id).where(Cart.user_id == self.user_id).scalar_subquery()
+        await self.db.execute(delete(CartItem).where(CartItem.cart_id == cart_ids))
+        await self.db.execute(delete(Cart).where(Cart.user_id == self.user_id))
 
-            product.stock += cart_item.quantity
+    async def clear_committed(self) -> None:
+        """Called once the transaction of clear is committed."""
+        await forget_cart_view(self.user_id)
 
-            await self.db.delete(cart_item)
-            await self.db.commit()
+    async def apply_changes(self, changes: List[CartLineUpdate]) -> CartBatchResponse:
+        """Setting the quantity of every line in one transaction, 0 removes it.
 
-    async def update_product_quantity(self, product_id: UUID, quantity: int) -> CartItem:
-        cart = await self.get_or_create_cart()
+        Products are locked by id before the reservations, the order every stock change of the cart, the orders
+        and the sweeper takes its locks in. A line without enough stock is left as it was and reported.
+        """
+        quantities = {change.product_id: change.quantity for change in changes}
+        product_ids = sorted(quantities)
+        available = dict((await self.db.execute(
+            select(Product.id, Product.available_stock.label("available_stock"))
+            .where(Product.id.in_(product_ids))
+            .order_by(Product.id)
+            .with_for_update()
+        )).all())
+        reserved = await lock_reservations(self.db, self.user_id, product_ids)
 
-        cart_item = await self.db.execute(
-            select(CartItem).where(CartItem.cart_id == cart.cart_id, CartItem.product_id == product_id)
+        errors, accepted = [], {}
+        for product_id in product_ids:
+            if product_id not in available:
+                errors.append(CartLineError(product_id=product_id, detail="Product not found"))
+            elif quantities[product_id] - reserved.get(product_id, 0) > available[product_id]:
+                errors.append(CartLineError(product_id=product_id, detail="Not enough stock available"))
+            else:
+                accepted[product_id] = quantities[product_id]
+
+        if accepted:
+            await set_reservations(self.db, self.user_id, accepted, reserved)
+            await self._write_items(accepted)
+        await self.db.commit()
+        if accepted:
+            await self._items_committed(accepted)
+            await forget_cart_view(self.user_id)
+
+        return CartBatchResponse(cart=await self.get_cart_view(), errors=errors)
+
+    async def _write_items(self, quantities: dict[UUID, int]) -> None:
+        """Upserting the changed lines and deleting the emptied ones, inside the transaction."""
+        cart_id = (await self.db.execute(
+            insert(Cart)
+            .values(cart_id=uuid.uuid4(), user_id=self.user_id)
+            .on_conflict_do_update(index_elements=[Cart.user_id], set_={"updated_at": func.now()})
+            .returning(Cart.cart_id)
+        )).scalar_one()
+
+        removed = [product_id for product_id, quantity in quantities.items() if not quantity]
+        if removed:
+            await self.db.execute(
+                delete(CartItem).where(CartItem.cart_id == cart_id, CartItem.product_id.in_(removed))
+            )
+
+        kept = [(product_id, quantity) for product_id, quantity in quantities.items() if quantity]
+        if kept:
+            upsert = insert(CartItem).values([
+                {"cart_item_id": uuid.uuid4(), "cart_id": cart_id, "product_id": product_id, "quantity": quantity}
+                for product_id, quantity in kept
+            ])
+            await self.db.execute(upsert.on_conflict_do_update(
+                index_elements=[CartItem.cart_id, CartItem.product_id],
+                set_={"quantity": upsert.excluded.quantity, "updated_at": func.now()},
+            ))
+
+    async def _items_committed(self, quantities: dict[UUID, int]) -> None:
+        """Hook for stores that keep the cart outside of the transaction."""
+
+    async def _cart_items(self) -> Select:
+        """Product ids and quantities of the cart as a selectable the view query joins products to."""
+        return select(CartItem.product_id, CartItem.quantity).join(Cart).where(Cart.user_id == self.user_id)
+
+    async def get_cart_view(self) -> CartResponse:
+        """Items with their discounted prices, line totals and the cart total from one joined query."""
+        items = (await self._cart_items()).subquery("items")
+        query = ProductDiscountService.apply_discount(
+            select(items.c.product_id, items.c.quantity, Product.name, Product.price)
+            .join(Product, Product.id == items.c.product_id)
         )
-        cart_item = cart_item.scalars().first()
+        line_total = query.selected_columns.final_price * items.c.quantity
+        query = query.add_columns(
+            line_total.label("line_total"), func.sum(line_total).over().label("total")
+        ).order_by(Product.name, Product.id)
 
-        if cart_item:
-            cart_item.quantity = quantity
+        rows = (await self.db.execute(query)).all()
+        return CartResponse(
+            items=[
+                CartLineResponse(
+                    product_id=row.product_id,
+                    name=row.name,
+                    quantity=row.quantity,
+                    base_price=row.price,
+                    discount_percentage=row.discount_percentage or 0,
+                    unit_price=row.final_price,
+                    line_total=row.line_total,
+                )
+                for row in rows
+            ],
+            total=rows[0].total if rows else 0,
+        )
+
+    async def get_cached_cart_view(self) -> bytes:
+        """JSON body of the cart view, kept for CART_VIEW_CACHE_TTL seconds and dropped on every cart write."""
+        key = cart_view_key(self.user_id)
+        if CART_VIEW_CACHE_TTL:
+            try:
+                body = await redis_cache_conn.get(key)
+            except RedisError:
+                body = None
+            if body is not None:
+                return body
+
+        body = FastAPICache.get_coder().encode(await self.get_cart_view())
+        if CART_VIEW_CACHE_TTL:
+            try:
+                await redis_cache_conn.set(key, body, ex=CART_VIEW_CACHE_TTL)
+            except RedisError:
+                pass
+        return body
+
+
+def cart_key(user_id: UUID) -> str:
+    return f"{CART_KEY_PREFIX}:{user_id}"
+
+
+def cart_view_key(user_id: UUID) -> str:
+    return f"{CART_VIEW_KEY_PREFIX}:{user_id}"
+
+
+async def forget_cart_view(user_id: UUID) -> None:
+    if CART_VIEW_CACHE_TTL:
+        try:
+            await redis_cache_conn.delete(cart_view_key(user_id))
+        except RedisError:
+            logger.warning("Cart view of %s was not purged", user_id, exc_info=True)
+
+
+class RedisCartService(CartService):
+    """Cart kept as a Redis hash of product id to quantity, written behind to the cart tables by flush_carts.
+
+    Redis is the authoritative copy of the cart, the stock reservations stay in Postgres and change with the cart.
+    """
+
+    async def add_product_to_cart(self, product_id: UUID, quantity: int = 1) -> CartItem:
+        if not await reserve(self.db, self.user_id, product_id, quantity):
+            await self._reservation_failed(product_id)
+        await self.db.commit()
+
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            pipe.hincrby(cart_key(self.user_id), str(product_id), quantity)
+            pipe.sadd(CART_DIRTY_KEY, str(self.user_id))
+            total, _ = await pipe.execute()
+        await forget_cart_view(self.user_id)
+        return CartItem(product_id=product_id, quantity=total)
+
+    async def remove_product_from_cart(self, product_id: UUID) -> None:
+        quantity = await _remove_item_script(keys=[cart_key(self.user_id)], args=[str(product_id)])
+        if quantity:
+            await redis_conn.sadd(CART_DIRTY_KEY, str(self.user_id))
+            await forget_cart_view(self.user_id)
+            await release(self.db, self.user_id, [product_id])
             await self.db.commit()
-            await self.db.refresh(cart_item)
-            return cart_item
-        else:
+
+    async def update_product_quantity(self, product_id: UUID, quantity: int) -> CartItem:
+        if not await redis_conn.hexists(cart_key(self.user_id), str(product_id)):
             raise ValueError("Product not found in cart")
+
+        await self._set_reservation(product_id, quantity)
+        await self.db.commit()
+        if not await _update_item_script(keys=[cart_key(self.user_id)], args=[str(product_id), quantity]):
+            # the line was removed meanwhile, the reservation just set goes with it
+            await release(self.db, self.user_id, [product_id])
+            await self.db.commit()
+            raise ValueError("Product not found in cart")
+        await redis_conn.sadd(CART_DIRTY_KEY, str(self.user_id))
+        await forget_cart_view(self.user_id)
+        return CartItem(product_id=product_id, quantity=quantity)
+
+    async def get_items(self) -> dict[UUID, int]:
+        items = await redis_conn.hgetall(cart_key(self.user_id))
+        return {UUID(product_id): int(quantity) for product_id, quantity in items.items() if int(quantity) > 0}
+
+    async def _write_items(self, quantities: dict[UUID, int]) -> None:
+        pass
+
+    async def _items_committed(self, quantities: dict[UUID, int]) -> None:
+        """Writing the lines to the hash once the reservations are committed."""
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            for product_id, quantity in quantities.items():
+                if quantity:
+                    pipe.hset(cart_key(self.user_id), str(product_id), quantity)
+                else:
+                    pipe.hdel(cart_key(self.user_id), str(product_id))
+            pipe.sadd(CART_DIRTY_KEY, str(self.user_id))
+            await pipe.execute()
+
+    async def _cart_items(self) -> Select:
+        """The hash passed in as two arrays unnested into rows, the view query stays the same as for the tables."""
+        items = await self.get_items()
+        return select(
+            func.unnest(
+                bindparam("cart_product_ids", list(items), type_=ARRAY(PG_UUID(as_uuid=True))),
+                bindparam("cart_quantities", list(items.values()), type_=ARRAY(Integer)),
+            )
+            .table_valued(column("product_id", PG_UUID(as_uuid=True)), column("quantity", Integer))
+            .render_derived()
+        )
+
+    async def clear_committed(self) -> None:
+        """Deleting the hash only after the tables are cleared, a failed transaction leaves the cart as it was."""
+        async with redis_conn.pipeline(transaction=True) as pipe:
+            pipe.delete(cart_key(self.user_id))
+            pipe.sadd(CART_DIRTY_KEY, str(self.user_id))
+            await pipe.execute()
+        await forget_cart_view(self.user_id)
+
+
+def get_cart_service(db: AsyncSession, user_id: UUID) -> CartService:
+    """Cart service of the configured CART_STORE, db or redis."""
+    if CART_STORE == "redis":
+        return RedisCartService(db, user_id)
+    return CartService(db, user_id)
+
+
+async def flush_carts(db: AsyncSession, batch_size: int = CART_FLUSH_BATCH_SIZE) -> int:
+    """Persisting a batch of dirty Redis carts in one transaction, returns how many carts were flushed.
+
+    Users are popped from the dirty set before their hash is read, so a change made meanwhile marks them dirty again
+    and is picked up by the next flush. A failed flush puts the users back.
+    """
+    user_ids = await redis_conn.spop(CART_DIRTY_KEY, batch_size)
+    if not user_ids:
+        return 0
+
+    try:
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(cart_key(user_id))
+            carts = dict(zip(map(UUID, user_ids), await pipe.execute()))
+
+        emptied = [user_id for user_id, items in carts.items() if not items]
+        if emptied:
+            cart_ids = select(Cart.cart_id).where(Cart.user_id.in_(emptied))
+            await db.execute(delete(CartItem).where(CartItem.cart_id.in_(cart_ids)))
+            await db.execute(delete(Cart).where(Cart.user_id.in_(emptied)))
+
+        filled = [user_id for user_id, items in carts.items() if items]
+        if filled:
+            upsert = insert(Cart).values([{"cart_id": uuid.uuid4(), "user_id": user_id} for user_id in filled])
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[Cart.user_id], set_={"updated_at": func.now()}
+            ).returning(Cart.user_id, Cart.cart_id)
+            cart_ids = dict((await db.execute(upsert)).all())
+
+            items = [
+                {"cart_item_id": uuid.uuid4(), "cart_id": cart_ids[user_id], "product_id": UUID(product_id),
+                 "quantity": int(quantity)}
+                for user_id in filled
+                for product_id, quantity in carts[user_id].items()
+                if int(quantity) > 0
+            ]
+            await db.execute(delete(CartItem).where(CartItem.cart_id.in_(cart_ids.values())))
+            if items:
+                await db.execute(insert(CartItem).values(items))
+
+        await db.commit()
+    except (RedisError, SQLAlchemyError):
+        await db.rollback()
+        await redis_conn.sadd(CART_DIRTY_KEY, *user_ids)
+        raise
+    return len(user_ids)
+
+
+async def flush_carts_forever(interval: float = CART_FLUSH_INTERVAL) -> None:
+    """Background write-behind of the Redis carts, drains the dirty set every interval seconds."""
+    while True:
+        try:
+            async with async_session() as db:
+                while await flush_carts(db) == CART_FLUSH_BATCH_SIZE:
+                    pass
+        except (RedisError, SQLAlchemyError):
+            logger.warning("Cart flush failed", exc_info=True)
+        await asyncio.sleep(interval)
@@ -1,11 +1,15 @@
+from datetime import datetime, timedelta
+
 from httpx import AsyncClient
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from src.auth.models import User
 from src.orders.models import Order, OrderStatus, OrderItem
 from src.products.models import ProductCategory, Product
-from src.shopping_cart.models import Cart, CartItem
+from src.shopping_cart.models import Cart, CartItem, StockReservation
+from src.shopping_cart.reservations import release_expired
 from tests.conftest import USER_NAME, PASSWORD
 
 
@@ -129,3 +133,100 @@ async def test_sales_report(client: AsyncClient, db_async_session: AsyncSession,
     response = await client.get("order/sales_report", params={"start_date": "2024-01-01", "min_quantity": 1})
     assert response.status_code == status.HTTP_200_OK
     assert len(response.json()) > 0
+
+
+async def test_create_order_spends_reserved_stock(client: AsyncClient, db_async_session: AsyncSession, user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access']}"}
+
+    category = ProductCategory(name="Electronics Reserved")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    laptop = Product(name="Laptop Reserved", category_id=category.id, price=1200.00, stock=10, is_active=True)
+    mouse = Product(name="Mouse Reserved", category_id=category.id, price=20.00, stock=5, is_active=True)
+    db_async_session.add_all([laptop, mouse])
+    await db_async_session.commit()
+
+    await client.post(f"/cart/add/{laptop.id}", params={"quantity": 3}, headers=headers)
+    await client.post(f"/cart/add/{mouse.id}", params={"quantity": 2}, headers=headers)
+
+    # the mouse stock drops under what the cart holds, the order fails and nothing of it is kept
+    await db_async_session.execute(update(Product).where(Product.id == mouse.id).values(stock=1))
+    await db_async_session.commit()
+
+    response = await client.post("/order/create", headers=headers)
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    orders = await db_async_session.execute(select(Order).where(Order.user_id == user.user_id))
+    assert orders.scalars().all() == []
+    reservations = await db_async_session.execute(
+        select(StockReservation.product_id, StockReservation.quantity).where(StockReservation.user_id == user.user_id)
+    )
+    assert dict(reservations.all()) == {laptop.id: 3, mouse.id: 2}
+
+    await db_async_session.execute(update(Product).where(Product.id == mouse.id).values(stock=5))
+    await db_async_session.commit()
+
+    response = await client.post("/order/create", headers=headers)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    await db_async_session.refresh(laptop)
+    await db_async_session.refresh(mouse)
+    assert (laptop.stock, laptop.available_stock) == (7, 7)
+    assert (mouse.stock, mouse.available_stock) == (3, 3)
+
+    reservations = await db_async_session.execute(
+        select(StockReservation).where(StockReservation.user_id == user.user_id)
+    )
+    assert reservations.scalars().all() == []
+    cart_items = await db_async_session.execute(select(CartItem).join(Cart).where(Cart.user_id == user.user_id))
+    assert cart_items.scalars().all() == []
+
+
+async def test_create_order_after_reservation_was_swept(client: AsyncClient, db_async_session: AsyncSession,
+                                                        user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access']}"}
+
+    category = ProductCategory(name="Electronics Swept")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(name="Laptop Swept", category_id=category.id, price=1200.00, stock=4, is_active=True)
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    await client.post(f"/cart/add/{product.id}", params={"quantity": 3}, headers=headers)
+    await db_async_session.execute(
+        update(StockReservation)
+        .where(StockReservation.product_id == product.id)
+        .values(expires_at=datetime.now() - timedelta(minutes=1))
+    )
+    await db_async_session.commit()
+    while await release_expired(db_async_session):
+        pass
+
+    # the stock freed by the sweep is sold to somebody else first
+    await db_async_session.execute(update(Product).where(Product.id == product.id).values(stock=2))
+    await db_async_session.commit()
+
+    response = await client.post("/order/create", headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    await db_async_session.execute(update(Product).where(Product.id == product.id).values(stock=4))
+    await db_async_session.commit()
+
+    response = await client.post("/order/create", headers=headers)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    await db_async_session.refresh(product)
+    assert (product.stock, product.available_stock) == (1, 1)
@@ -1,14 +1,26 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
 import time
+from datetime import datetime
 from decimal import Decimal
 
 import pytest
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
 from sqlalchemy.future import select
 from uuid import uuid4
+from src.auth.models import User
+from src.cache import CACHE_PREFIX, get_many, invalidate_tags, set_many
+from src.database import redis_conn
+from src.products.cache import FACETS_TAG, stock_change_tags
 from src.products.models import Product, ProductCategory, ProductDiscount
 from src.products.schemas import ProductCreate, ProductUpdate
 from fastapi import status
+from tests.conftest import USER_NAME, PASSWORD
 
 
 async def test_get_products(client: AsyncClient, db_async_session: AsyncSession):
@@ -37,6 +49,78 @@ async def test_get_products(client: AsyncClient, db_async_session: AsyncSession)
     assert response_json["items"][0]["name"] == "Chair"
 
 
+async def test_get_products_skips_out_of_stock(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(id=uuid4(), name="Office Chairs")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    in_stock = Product(
+        name="Office Chair",
+        description="Ergonomic",
+        category_id=category.id,
+        price=299.99,
+        stock=5,
+        reserved=0,
+        is_active=True
+    )
+    sold_out = Product(
+        name="Sold Out Chair",
+        description="Ergonomic",
+        category_id=category.id,
+        price=199.99,
+        stock=3,
+        reserved=3,
+        is_active=True
+    )
+    db_async_session.add_all([in_stock, sold_out])
+    await db_async_session.commit()
+
+    response = await client.get("/products/filter/", params={"size": 5, "page": 1, "category_id": category.id})
+    assert response.status_code == status.HTTP_200_OK
+
+    response_json = response.json()
+
+    assert response_json["total"] == 1
+    assert [item["name"] for item in response_json["items"]] == ["Office Chair"]
+
+
+async def test_get_products_by_cursor(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(id=uuid4(), name="Bar Stools")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    for number in range(3):
+        db_async_session.add(Product(
+            name=f"Stool {number}",
+            description="Bar",
+            category_id=category.id,
+            price=49.99,
+            stock=10,
+            is_active=True
+        ))
+        await db_async_session.commit()
+
+    names = []
+    cursor = None
+    while True:
+        params = {"size": 2, "category_id": category.id}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get("/products/cursor/", params=params)
+        assert response.status_code == status.HTTP_200_OK
+
+        response_json = response.json()
+        names += [item["name"] for item in response_json["items"]]
+        cursor = response_json["next_cursor"]
+        if cursor is None:
+            break
+
+    assert names == ["Stool 0", "Stool 1", "Stool 2"]
+
+    response = await client.get("/products/cursor/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 async def test_update_product_price(client: AsyncClient, db_async_session: AsyncSession):
     category = ProductCategory(id=uuid4(), name="Electronics Machines")
     db_async_session.add(category)
@@ -231,3 +315,503 @@ async def test_create_discount(client: AsyncClient, db_async_session: AsyncSessi
 
     assert discount is not None
     assert discount.discount_percentage == discount_percentage
+
+
+async def test_get_products_with_latest_discount(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Lamps")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(
+        name="Desk Lamp",
+        description="LED",
+        category_id=category.id,
+        price=200.00,
+        stock=15,
+        is_active=True
+    )
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    db_async_session.add(ProductDiscount(product_id=product.id, discount_percentage=10))
+    await db_async_session.commit()
+    db_async_session.add(ProductDiscount(product_id=product.id, discount_percentage=20))
+    await db_async_session.commit()
+
+    response = await client.get("/products/filter/", params={"size": 5, "page": 1, "category_id": category.id})
+    assert response.status_code == status.HTTP_200_OK
+
+    item = response.json()["items"][0]
+    assert Decimal(item["price"]) == Decimal("160.00")
+    assert [discount["discount_percentage"] for discount in item["discounts"]] == [20]
+
+    await db_async_session.refresh(product)
+    assert product.price == Decimal("200.00")
+
+
+async def test_filter_products_by_ancestor_category(client: AsyncClient, db_async_session: AsyncSession):
+    root = ProductCategory(name="Home")
+    child = ProductCategory(name="Kitchen", parent=root)
+    grandchild = ProductCategory(name="Cookware", parent=child)
+    db_async_session.add_all([root, child, grandchild])
+    await db_async_session.commit()
+
+    product = Product(
+        name="Frying Pan",
+        description="Cast iron",
+        category_id=grandchild.id,
+        price=39.99,
+        stock=7,
+        is_active=True
+    )
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    response = await client.get("/products/filter/", params={"size": 5, "page": 1, "subcategory_id": root.id})
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["name"] for item in response.json()["items"]] == ["Frying Pan"]
+
+    grandchild.parent = root
+    await db_async_session.commit()
+
+    response = await client.get("/products/filter/", params={"size": 5, "page": 1, "subcategory_id": child.id})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["total"] == 0
+
+
+async def test_search_products(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Peripherals")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    db_async_session.add_all([
+        Product(
+            name="Wireless Mouse",
+            description="Comes with a keyboard shortcut guide",
+            category_id=category.id,
+            price=25.00,
+            stock=40,
+            is_active=True
+        ),
+        Product(
+            name="Mechanical Keyboard",
+            description="Hot-swappable switches",
+            category_id=category.id,
+            price=120.00,
+            stock=12,
+            is_active=True
+        ),
+        Product(
+            name="Monitor Stand",
+            description="Aluminium",
+            category_id=category.id,
+            price=45.00,
+            stock=8,
+            is_active=True
+        ),
+    ])
+    await db_async_session.commit()
+
+    response = await client.get("/products/search/", params={"q": "keyboards", "size": 5, "page": 1})
+    assert response.status_code == status.HTTP_200_OK
+
+    response_json = response.json()
+    assert response_json["total"] == 2
+    assert [item["name"] for item in response_json["items"]] == ["Mechanical Keyboard", "Wireless Mouse"]
+
+
+async def test_suggest_products(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Audio")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    db_async_session.add_all([
+        Product(name="Headphones Pro", category_id=category.id, price=150.00, stock=5, is_active=True),
+        Product(name="Headset", category_id=category.id, price=60.00, stock=5, is_active=True),
+        Product(name="Speaker", category_id=category.id, price=90.00, stock=5, is_active=True),
+    ])
+    await db_async_session.commit()
+
+    response = await client.get("/products/suggest/", params={"prefix": "hEaD"})
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["name"] for item in response.json()] == ["Headset", "Headphones Pro"]
+    assert set(response.json()[0]) == {"id", "name"}
+
+
+async def test_product_facets(client: AsyncClient, db_async_session: AsyncSession):
+    root = ProductCategory(name="Garden")
+    tools = ProductCategory(name="Garden Tools", parent=root)
+    seeds = ProductCategory(name="Seeds", parent=root)
+    db_async_session.add_all([root, tools, seeds])
+    await db_async_session.commit()
+
+    db_async_session.add_all([
+        Product(name="Shovel", category_id=tools.id, price=30.00, stock=5, is_active=True),
+        Product(name="Lawn Mower", category_id=tools.id, price=300.00, stock=2, is_active=True),
+        Product(name="Tomato Seeds", category_id=seeds.id, price=3.00, stock=100, is_active=True),
+        Product(name="Basil Seeds", category_id=seeds.id, price=2.00, stock=0, is_active=True),
+    ])
+    await db_async_session.commit()
+
+    response = await client.get("/products/facets/", params={"subcategory_id": root.id})
+    assert response.status_code == status.HTTP_200_OK
+
+    response_json = response.json()
+    assert response_json["total"] == 3
+    assert {facet["category_id"]: facet["count"] for facet in response_json["categories"]} == {
+        str(tools.id): 2, str(seeds.id): 1
+    }
+    assert [(facet["max_price"], facet["count"]) for facet in response_json["price_ranges"]] == [
+        ("50", 2), ("500", 1)
+    ]
+
+    response = await client.get("/products/facets/", params={"subcategory_id": root.id, "min_price": 10})
+
+    response_json = response.json()
+    assert response_json["total"] == 2
+    assert {facet["category_id"]: facet["count"] for facet in response_json["categories"]} == {str(tools.id): 2}
+
+
+async def test_stock_changes_keep_facets_until_availability_flips():
+    product_id, category_id = uuid4(), uuid4()
+
+    assert FACETS_TAG not in stock_change_tags(product_id, category_id, 5, 3)
+    assert FACETS_TAG in stock_change_tags(product_id, category_id, 1, 0)
+    assert FACETS_TAG in stock_change_tags(product_id, category_id, 0, 2)
+
+
+async def test_import_products(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Imported Goods")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    existing = Product(name="Teapot", category_id=category.id, price=20.00, stock=1, is_active=True)
+    db_async_session.add(existing)
+    await db_async_session.commit()
+
+    body = "\n".join([
+        f'{{"name": "Teapot", "category_id": "{category.id}", "price": "25.00", "stock": 4}}',
+        f'{{"name": "Teacup", "category_id": "{category.id}", "price": "5.00", "stock": 30}}',
+        f'{{"name": "Saucer", "category_id": "{uuid4()}", "price": "3.00", "stock": 30}}',
+        '{"name": "Kettle", "price": "oops"}',
+        "not json",
+    ])
+    response = await client.post("/products/import/", content=body, params={"format": "ndjson"})
+    assert response.status_code == status.HTTP_200_OK
+
+    response_json = response.json()
+    assert response_json["created"] == 1
+    assert response_json["updated"] == 1
+    assert [error["line"] for error in response_json["errors"]] == [3, 4, 5]
+
+    await db_async_session.refresh(existing)
+    assert existing.price == Decimal("25.00")
+    assert existing.stock == 4
+
+
+async def test_import_products_csv(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Imported Kitchenware")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    body = "\n".join([
+        "name,description,category_id,price,stock",
+        f'Ladle,"Steel ladle,\nlong handle",{category.id},7.00,3',
+        f"Whisk,,{category.id},4.00,5",
+        f"Whisk,,{category.id},4.50,6",
+    ])
+    response = await client.post("/products/import/", content=body, params={"format": "csv"})
+    assert response.status_code == status.HTTP_200_OK
+
+    response_json = response.json()
+    assert response_json["created"] == 2
+    assert [error["line"] for error in response_json["errors"]] == [4]
+
+    ladle = await db_async_session.execute(select(Product).where(Product.name == "Ladle"))
+    assert ladle.scalars().one().description == "Steel ladle,\nlong handle"
+    whisk = await db_async_session.execute(select(Product).where(Product.name == "Whisk"))
+    assert whisk.scalars().one().stock == 6
+
+
+async def test_bulk_update_products(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Stationery")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    pen = Product(name="Pen", category_id=category.id, price=2.00, stock=100, is_active=True)
+    pencil = Product(name="Pencil", category_id=category.id, price=1.00, stock=50, is_active=True)
+    db_async_session.add_all([pen, pencil])
+    await db_async_session.commit()
+
+    missing_id = uuid4()
+    response = await client.put("/products/bulk/", json={"items": [
+        {"product_id": str(pen.id), "price": "2.50"},
+        {"product_id": str(pencil.id), "stock": 75},
+        {"product_id": str(missing_id), "price": "9.99", "stock": 1},
+    ]})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"updated": 2, "not_found": [str(missing_id)]}
+
+    await db_async_session.refresh(pen)
+    await db_async_session.refresh(pencil)
+    assert (pen.price, pen.stock) == (Decimal("2.50"), 100)
+    assert (pencil.price, pencil.stock) == (Decimal("1.00"), 75)
+
+
+async def test_export_products(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Toys")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    old_toy = Product(name="Yo-yo", category_id=category.id, price=4.00, stock=10, is_active=True,
+                      updated_at=datetime(2020, 1, 1))
+    new_toy = Product(name="Kite", category_id=category.id, price=15.00, stock=3, is_active=True)
+    db_async_session.add_all([old_toy, new_toy])
+    await db_async_session.commit()
+
+    response = await client.get("/products/export/", params={"updated_since": "2021-01-01T00:00:00"})
+    assert response.status_code == status.HTTP_200_OK
+    assert [json.loads(line)["name"] for line in response.text.splitlines()] == ["Kite"]
+
+    response = await client.get("/products/export/", params={"format": "csv", "gzip": True})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/gzip"
+    assert "content-encoding" not in response.headers
+
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode())))
+    assert [row["name"] for row in rows] == ["Yo-yo", "Kite"]
+
+
+async def test_product_cache_invalidated_on_write(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Cameras")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(name="Instant Camera", category_id=category.id, price=80.00, stock=5, is_active=True)
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    params = {"category_id": str(category.id)}
+    response = await client.get("/products/filter/", params=params)
+    assert response.json()["items"][0]["price"] == "80.00"
+
+    await client.put(f"/products/{product.id}/price/", params={"new_price": "60.00"})
+    response = await client.get("/products/filter/", params=params)
+    assert response.json()["items"][0]["price"] == "60.00"
+
+    await client.delete(f"/products/{product.id}/")
+    response = await client.get("/products/filter/", params=params)
+    assert response.json()["items"] == []
+
+
+async def test_concurrent_cache_misses_share_result(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Drones")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    db_async_session.add(Product(name="Quadcopter", category_id=category.id, price=300.00, stock=4, is_active=True))
+    await db_async_session.commit()
+
+    params = {"category_id": str(category.id), "size": 7}
+    responses = await asyncio.gather(*[client.get("/products/filter/", params=params) for _ in range(10)])
+
+    assert {response.status_code for response in responses} == {status.HTTP_200_OK}
+    assert all(response.json() == responses[0].json() for response in responses)
+    assert responses[0].json()["items"][0]["name"] == "Quadcopter"
+
+
+async def test_stale_product_list_served_while_refreshed(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Watches")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    watch = Product(name="Diver Watch", category_id=category.id, price=250.00, stock=2, is_active=True)
+    db_async_session.add(watch)
+    await db_async_session.commit()
+
+    response = await client.get("/products/", params={"size": 3})
+    assert response.json()["items"][0]["price"] == "250.00"
+
+    # a Core update bypasses the invalidation hooks, so only the stale refresh can pick it up
+    await db_async_session.execute(update(Product).where(Product.id == watch.id).values(price=200))
+    await db_async_session.commit()
+    await redis_conn.expire(f"{CACHE_PREFIX}:/products/?size=3", 5)
+
+    response = await client.get("/products/", params={"size": 3})
+    assert response.json()["items"][0]["price"] == "250.00"
+
+    for _ in range(20):
+        await asyncio.sleep(0.1)
+        response = await client.get("/products/", params={"size": 3})
+        if response.json()["items"][0]["price"] == "200.00":
+            break
+    assert response.json()["items"][0]["price"] == "200.00"
+
+
+async def test_cache_store_checks_only_its_own_tags():
+    key, other_key = f"{CACHE_PREFIX}:test:entry", f"{CACHE_PREFIX}:test:other-entry"
+    await redis_conn.delete(key, other_key)
+    version, _ = await get_many([key])
+
+    await invalidate_tags("test:unrelated")
+    await set_many([(key, b"[]", ["test:mine"])], version)
+    assert await redis_conn.get(key) == "[]"
+
+    await invalidate_tags("test:mine")
+    assert await redis_conn.get(key) is None
+    await set_many([(other_key, b"[]", ["test:mine"])], version)
+    assert await redis_conn.get(other_key) is None
+
+
+async def test_cache_stats(client: AsyncClient, db_async_session: AsyncSession, user: User):
+    category = ProductCategory(name="Puzzles")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access']}"}
+    assert (await client.get("/cache/stats/")).status_code == status.HTTP_401_UNAUTHORIZED
+    assert (await client.get("/cache/stats/", headers=headers)).status_code == status.HTTP_403_FORBIDDEN
+
+    user.is_superuser = True
+    db_async_session.add(user)
+    await db_async_session.commit()
+
+    params = {"category_id": str(category.id), "size": 9}
+    await client.get("/products/filter/", params=params)
+    before = (await client.get("/cache/stats/", headers=headers)).json()
+
+    await client.get("/products/filter/", params=params)
+    after = (await client.get("/cache/stats/", headers=headers)).json()
+
+    user.is_superuser = False
+    await db_async_session.commit()
+
+    assert after["redis_hits"] + after["l1_hits"] == before["redis_hits"] + before["l1_hits"] + 1
+
+
+async def test_product_list_conditional_request(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Lamps")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    lamp = Product(name="Desk Lamp", category_id=category.id, price=35.00, stock=6, is_active=True)
+    db_async_session.add(lamp)
+    await db_async_session.commit()
+
+    params = {"category_id": str(category.id)}
+    response = await client.get("/products/filter/", params=params)
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"].startswith("public")
+
+    response = await client.get("/products/filter/", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    await invalidate_tags("test:unrelated")
+    response = await client.get("/products/filter/", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    await client.put(f"/products/{lamp.id}/price/", params={"new_price": "30.00"})
+    response = await client.get("/products/filter/", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+
+
+async def test_cached_page_body_matches_fresh_one(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Rugs")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    db_async_session.add(Product(name="Wool Rug", category_id=category.id, price=120.50, stock=2, is_active=True))
+    await db_async_session.commit()
+
+    params = {"category_id": str(category.id)}
+    fresh = await client.get("/products/filter/", params=params, headers={"Cache-Control": "no-cache"})
+    cached = await client.get("/products/filter/", params=params)
+
+    assert cached.headers["content-type"] == "application/json"
+    assert cached.content == fresh.content
+    assert cached.json()["items"][0]["price"] == "120.50"
+
+
+async def test_get_product_detail(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Bikes")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    bike = Product(name="Road Bike", category_id=category.id, price=1000.00, stock=5, reserved=2, is_active=True)
+    db_async_session.add(bike)
+    await db_async_session.commit()
+
+    response = await client.get(f"/products/{bike.id}/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["price"] == "1000.00"
+    assert response.json()["available_stock"] == 3
+
+    await client.post(f"/products/{bike.id}/discount/", params={"discount_percentage": 10})
+    response = await client.get(f"/products/{bike.id}/")
+    assert response.json()["price"] == "900.00"
+    assert response.json()["discounts"][0]["discount_percentage"] == 10
+
+    response = await client.get(f"/products/{uuid4()}/")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_get_products_batch(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Mugs")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    mugs = [Product(name=f"Mug {number}", category_id=category.id, price=10 + number, stock=number, is_active=True)
+            for number in range(3)]
+    db_async_session.add_all(mugs)
+    await db_async_session.commit()
+
+    # warm the per-product entry of one of them
+    await client.get(f"/products/{mugs[1].id}/")
+
+    ids = [mugs[2].id, uuid4(), mugs[0].id, mugs[1].id]
+    response = await client.get("/products/batch/", params={"ids": ",".join(map(str, ids))})
+    assert response.status_code == status.HTTP_200_OK
+    assert [product["name"] for product in response.json()] == ["Mug 2", "Mug 0", "Mug 1"]
+    assert response.json()[1]["available_stock"] == 0
+
+    etag = response.headers["ETag"]
+    response = await client.get("/products/batch/", params={"ids": ",".join(map(str, ids))},
+                                headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    response = await client.get("/products/batch/", params={"ids": "not-an-id"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_filter_products_by_price_and_sort(client: AsyncClient, db_async_session: AsyncSession):
+    category = ProductCategory(name="Guitars")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    acoustic = Product(name="Acoustic", category_id=category.id, price=300.00, stock=3, is_active=True)
+    electric = Product(name="Electric", category_id=category.id, price=800.00, stock=3, is_active=True)
+    bass = Product(name="Bass", category_id=category.id, price=600.00, stock=3, is_active=True)
+    db_async_session.add_all([acoustic, electric, bass])
+    await db_async_session.commit()
+
+    db_async_session.add(ProductDiscount(product_id=electric.id, discount_percentage=50))
+    await db_async_session.commit()
+
+    params = {"category_id": str(category.id)}
+    response = await client.get("/products/filter/", params={**params, "sort": "price"})
+    assert [item["name"] for item in response.json()["items"]] == ["Acoustic", "Electric", "Bass"]
+
+    response = await client.get("/products/filter/", params={**params, "sort": "-price", "max_price": 500})
+    assert [item["name"] for item in response.json()["items"]] == ["Electric", "Acoustic"]
+
+    response = await client.get("/products/filter/", params={**params, "sort": "name", "min_price": 350})
+    assert [item["name"] for item in response.json()["items"]] == ["Bass", "Electric"]
+    assert response.json()["total"] == 2
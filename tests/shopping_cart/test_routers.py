@@ -1,13 +1,18 @@
 import time
+from datetime import datetime, timedelta
+from uuid import uuid4
 
+import pytest
 from httpx import AsyncClient
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from src.auth.models import User
-from src.products.models import ProductCategory, Product
-from src.shopping_cart.models import CartItem, Cart
+from src.products.models import ProductCategory, Product, ProductDiscount
+from src.shopping_cart.models import CartItem, Cart, StockReservation
+from src.shopping_cart.reservations import release_expired
+from src.shopping_cart.services import RedisCartService, flush_carts
 from tests.conftest import USER_NAME, PASSWORD
 
 
@@ -144,3 +149,290 @@ async def test_update_cart_item(client: AsyncClient, db_async_session: AsyncSess
 
     assert cart_item is not None
     assert cart_item.quantity == 5
+
+
+async def test_add_to_cart_rejects_bad_requests(client: AsyncClient, db_async_session: AsyncSession, user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access']}"}
+
+    category = ProductCategory(name="Electronics Game10")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(name="Laptop10", category_id=category.id, price=100.00, stock=3, is_active=True)
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    response = await client.post(f"/cart/add/{product.id}", params={"quantity": -2}, headers=headers)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    response = await client.put(f"/cart/update/{product.id}", params={"quantity": 0}, headers=headers)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    response = await client.post(f"/cart/add/{product.id}", params={"quantity": 4}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = await client.post(f"/cart/add/{uuid4()}", params={"quantity": 1}, headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    await db_async_session.refresh(product)
+    assert product.available_stock == 3
+
+
+async def test_add_to_cart_merges_item_and_reserves_stock(client: AsyncClient, db_async_session: AsyncSession,
+                                                          user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    access_token = response.json()["access"]
+
+    category = ProductCategory(name="Electronics Game5")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(
+        name="Laptop5",
+        description="Gaming Laptop",
+        category_id=category.id,
+        price=1200.00,
+        stock=5,
+        is_active=True
+    )
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    for quantity in (2, 3):
+        response = await client.post(
+            f"/cart/add/{product.id}",
+            params={"quantity": quantity},
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    cart_items = await db_async_session.execute(select(CartItem).where(CartItem.product_id == product.id))
+    cart_items = cart_items.scalars().all()
+    await db_async_session.refresh(product)
+
+    assert len(cart_items) == 1
+    assert cart_items[0].quantity == 5
+    assert product.stock == 5
+    assert product.available_stock == 0
+
+
+async def test_redis_cart_is_flushed_to_tables(db_async_session: AsyncSession, user: User):
+    category = ProductCategory(name="Electronics Game6")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(
+        name="Laptop6",
+        description="Gaming Laptop",
+        category_id=category.id,
+        price=1200.00,
+        stock=10,
+        is_active=True
+    )
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    service = RedisCartService(db_async_session, user.user_id)
+    await service.clear()
+    await db_async_session.commit()
+    await service.clear_committed()
+    await service.add_product_to_cart(product.id, 2)
+    await service.add_product_to_cart(product.id, 1)
+
+    assert await service.get_items() == {product.id: 3}
+
+    while await flush_carts(db_async_session):
+        pass
+
+    cart_items = await db_async_session.execute(
+        select(CartItem).join(Cart).where(Cart.user_id == user.user_id).execution_options(populate_existing=True)
+    )
+    cart_items = cart_items.scalars().all()
+    await db_async_session.refresh(product)
+
+    assert [(item.product_id, item.quantity) for item in cart_items] == [(product.id, 3)]
+    assert product.available_stock == 7
+
+
+async def test_get_cart(client: AsyncClient, db_async_session: AsyncSession, user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    access_token = response.json()["access"]
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    category = ProductCategory(name="Electronics Game7")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    discounted = Product(name="Laptop7", category_id=category.id, price=100.00, stock=10, is_active=True)
+    regular = Product(name="Mouse7", category_id=category.id, price=20.00, stock=10, is_active=True)
+    db_async_session.add_all([discounted, regular])
+    await db_async_session.commit()
+    db_async_session.add(ProductDiscount(product_id=discounted.id, discount_percentage=10))
+    await db_async_session.commit()
+
+    await client.delete(f"/cart/remove/{discounted.id}", headers=headers)
+    await client.post(f"/cart/add/{discounted.id}", params={"quantity": 2}, headers=headers)
+    await client.get("/cart/", headers=headers)
+    await client.post(f"/cart/add/{regular.id}", params={"quantity": 3}, headers=headers)
+
+    response = await client.get("/cart/", headers=headers)
+
+    assert response.status_code == status.HTTP_200_OK
+    lines = {line["product_id"]: line for line in response.json()["items"]}
+    assert float(lines[str(discounted.id)]["unit_price"]) == 90
+    assert float(lines[str(discounted.id)]["line_total"]) == 180
+    assert float(lines[str(regular.id)]["line_total"]) == 60
+    assert float(response.json()["total"]) == sum(float(line["line_total"]) for line in lines.values())
+
+
+async def test_update_cart_in_batch(client: AsyncClient, db_async_session: AsyncSession, user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    access_token = response.json()["access"]
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    category = ProductCategory(name="Electronics Game8")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    laptop = Product(name="Laptop8", category_id=category.id, price=100.00, stock=10, is_active=True)
+    mouse = Product(name="Mouse8", category_id=category.id, price=20.00, stock=1, is_active=True)
+    db_async_session.add_all([laptop, mouse])
+    await db_async_session.commit()
+
+    response = await client.patch("/cart/", headers=headers, json=[
+        {"product_id": str(laptop.id), "quantity": 4},
+        {"product_id": str(mouse.id), "quantity": 2},
+    ])
+
+    assert response.status_code == status.HTTP_200_OK
+    lines = {line["product_id"]: line for line in response.json()["cart"]["items"]}
+    assert lines[str(laptop.id)]["quantity"] == 4
+    assert str(mouse.id) not in lines
+    assert response.json()["errors"] == [{"product_id": str(mouse.id), "detail": "Not enough stock available"}]
+
+    response = await client.patch("/cart/", headers=headers, json=[{"product_id": str(laptop.id), "quantity": 0}])
+
+    assert str(laptop.id) not in {line["product_id"] for line in response.json()["cart"]["items"]}
+    await db_async_session.refresh(laptop)
+    assert laptop.available_stock == 10
+
+
+async def test_expired_reservations_are_released(client: AsyncClient, db_async_session: AsyncSession, user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    access_token = response.json()["access"]
+
+    category = ProductCategory(name="Electronics Game9")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(name="Laptop9", category_id=category.id, price=100.00, stock=10, is_active=True)
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    await client.post(f"/cart/add/{product.id}", params={"quantity": 4},
+                      headers={"Authorization": f"Bearer {access_token}"})
+    await db_async_session.refresh(product)
+    assert product.available_stock == 6
+
+    await db_async_session.execute(
+        update(StockReservation)
+        .where(StockReservation.product_id == product.id)
+        .values(expires_at=datetime.now() - timedelta(minutes=1))
+    )
+    await db_async_session.commit()
+
+    while await release_expired(db_async_session):
+        pass
+
+    await db_async_session.refresh(product)
+    reservation = await db_async_session.execute(
+        select(StockReservation).where(StockReservation.product_id == product.id)
+    )
+
+    assert product.available_stock == 10
+    assert reservation.scalars().first() is None
+
+
+async def test_update_cart_item_moves_reservation(client: AsyncClient, db_async_session: AsyncSession, user: User):
+    response = await client.post(
+        "/auth/login",
+        data={"username": USER_NAME, "password": PASSWORD},
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access']}"}
+
+    category = ProductCategory(name="Electronics Game11")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(name="Laptop11", category_id=category.id, price=100.00, stock=5, is_active=True)
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    await client.post(f"/cart/add/{product.id}", params={"quantity": 2}, headers=headers)
+
+    response = await client.put(f"/cart/update/{product.id}", params={"quantity": 6}, headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    await db_async_session.refresh(product)
+    assert product.available_stock == 3
+
+    response = await client.put(f"/cart/update/{product.id}", params={"quantity": 5}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    await db_async_session.refresh(product)
+    assert product.available_stock == 0
+
+    response = await client.put(f"/cart/update/{product.id}", params={"quantity": 1}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    await db_async_session.refresh(product)
+    reservation = await db_async_session.execute(
+        select(StockReservation.quantity).where(StockReservation.product_id == product.id)
+    )
+    assert product.available_stock == 4
+    assert reservation.scalar_one() == 1
+
+
+async def test_redis_cart_update_moves_reservation(db_async_session: AsyncSession, user: User):
+    category = ProductCategory(name="Electronics Game12")
+    db_async_session.add(category)
+    await db_async_session.commit()
+
+    product = Product(name="Laptop12", category_id=category.id, price=100.00, stock=5, is_active=True)
+    db_async_session.add(product)
+    await db_async_session.commit()
+
+    service = RedisCartService(db_async_session, user.user_id)
+    await service.clear()
+    await db_async_session.commit()
+    await service.clear_committed()
+    await service.add_product_to_cart(product.id, 2)
+
+    with pytest.raises(ValueError, match="Not enough stock available"):
+        await service.update_product_quantity(product.id, 6)
+    assert await service.get_items() == {product.id: 2}
+
+    await service.update_product_quantity(product.id, 1)
+    await db_async_session.refresh(product)
+
+    assert await service.get_items() == {product.id: 1}
+    assert product.available_stock == 4